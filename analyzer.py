@@ -1,24 +1,103 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import streamlit as st
 
-def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None):
+from profiler import frame_hash, get_profile, get_view_profile, profile_cache
+from jobs import run_in_background
+from correlation import top_pairs
+from cube import cube_cache, dimensions, get_cube, grouping_cube, split_dimensions, top_groups
+from charts import (
+    render_chart, draw_heatmap, draw_value_counts_bar, draw_pie,
+    draw_histogram, draw_line, draw_scatter, draw_group_bar, draw_time_series
+)
+from timeseries import date_columns, get_rollups, rollup_cache, rollup_series
+from filters import filter_panel
+
+def show_chart(chart, warning=None):
+    # display a (png, caption) pair from render_chart, or the warning if there was nothing to plot
+    png, caption = chart
+    if png is None:
+        st.warning(warning)
+        return
+    st.image(png)
+    if caption:
+        st.caption(caption)
+
+def show_time_series(df, content_hash, key, date_col, measure):
+    # measure over date_col, read from the daily / weekly / monthly rollup that fits the
+    # selected date range instead of plotting every row
+    c1, c2 = st.columns(2)
+    splits = [d for d in dimensions(df, content_hash) if d != date_col]
+    split = None
+    if splits:
+        split = c2.selectbox(
+            "Split by (optional):",
+            [None] + splits,
+            format_func=lambda c: "—" if c is None else c,
+            key=f"{key}_ts_split"
+        )
+    rollups = rollup_cache.get(("rollups", content_hash, date_col, measure, split))
+    if rollups is None:
+        rollups = run_in_background(
+            f"{key}_rollups", ("rollups", content_hash, date_col, measure, split),
+            get_rollups, df, content_hash, date_col, measure, split,
+            label="Rolling up by date..."
+        )
+    if rollups["start"] is None:
+        st.warning(f"No valid dates in {date_col}.")
+        return
+    first, last = rollups["start"].date(), rollups["end"].date()
+    start, end = first, last
+    if first < last:
+        range_key = f"{key}_ts_range"
+        # a range from another dataset or column may not fit this one
+        current = st.session_state.get(range_key)
+        if current is not None and not (first <= current[0] and current[1] <= last):
+            del st.session_state[range_key]
+        start, end = c1.slider("Date range", min_value=first, max_value=last, value=(first, last), key=range_key)
+    values, level = rollup_series(rollups, start, end)
+    show_chart(render_chart(
+        (content_hash, "time_series", date_col, measure, split, start, end),
+        lambda fig, ax: draw_time_series(fig, ax, values, measure, date_col, level)
+    ), "No values to plot in this date range.")
+
+def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None, content_hash=None, profile=None):
     # display stats, missing values and charts
+    # statistics and rendered charts are cached by content_hash, computed here if the caller
+    # does not know it. a precomputed profile (e.g. from streaming ingestion) is used as is.
+    if content_hash is None:
+        content_hash = frame_hash(df)
+    base_df, base_hash = df, content_hash
+    # everything below runs on the rows picked in the filter panel, cached under their own hash
+    df, content_hash, filters = filter_panel(
+        df, content_hash, key_prefix, (initial_config or {}).get("filters")
+    )
+    if filters:
+        # a precomputed profile describes all rows
+        profile = None
+    # the profile is computed in the worker pool so the page shows progress meanwhile
+    if profile is None:
+        profile = profile_cache.get(content_hash)
+    if profile is None:
+        profile = run_in_background(
+            f"{key_prefix}_profile", ("profile", content_hash),
+            get_view_profile if filters else get_profile, df, content_hash,
+            label="Computing summary statistics..."
+        )
+
     st.subheader("Summary Statistics")
-    st.dataframe(df.describe(include="all").T)
+    st.dataframe(profile["summary"])
 
     st.subheader("Missing Values")
-    missing = df.isnull().sum().reset_index()
-    missing.columns = ['Column', 'Missing Count']
-    st.dataframe(missing)
+    st.dataframe(profile["missing"])
 
     st.subheader("Correlation Heatmap")
-    numeric = df.select_dtypes(include="number")
-    if numeric.shape[1] > 1:
-        fig, ax = plt.subplots()
-        sns.heatmap(numeric.corr(), annot=True, cmap="Blues", ax=ax)
-        st.pyplot(fig)
+    if profile["correlation"] is not None:
+        show_chart(render_chart(
+            (content_hash, "heatmap"),
+            lambda fig, ax: draw_heatmap(fig, ax, profile["correlation"])
+        ))
+        st.caption("Strongest correlations")
+        st.dataframe(top_pairs(profile["correlation"]), hide_index=True)
     else:
         st.info("No numeric columns found for correlation.")
 
@@ -26,6 +105,7 @@ def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None):
 
     plot_col_key = f"{key_prefix}_plot_column"
     plot_type_key = f"{key_prefix}_plot_type"
+    plot_time_key = f"{key_prefix}_plot_time"
 
     if initial_config:
         qp = initial_config.get("quick_plot", {})
@@ -35,6 +115,9 @@ def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None):
             st.session_state[plot_col_key] = col_default
         if type_default in ["Bar", "Pie", "Histogram", "Line"] and plot_type_key not in st.session_state:
             st.session_state[plot_type_key] = type_default
+        time_default = qp.get("time_axis")
+        if (time_default == "Row order" or time_default in df.columns) and plot_time_key not in st.session_state:
+            st.session_state[plot_time_key] = time_default
 
     col = st.selectbox(
         "Select column to plot:",
@@ -47,43 +130,44 @@ def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None):
         key=plot_type_key
     )
 
-    fig, ax = plt.subplots()
-
     if chart_type == "Bar":
-        counts = df[col].astype(str).value_counts()
-        if counts.empty or counts.nunique() == len(df):
-            st.warning("Nothing meaningful to plot as a bar chart.")
-        else:
-            counts.head(20).plot(kind="bar", ax=ax)
-            ax.set_ylabel("Count")
-            ax.set_title(f"Bar chart of {col}")
-            plt.xticks(rotation=45, ha="right")
-            st.pyplot(fig)
+        show_chart(render_chart(
+            (content_hash, "bar", col),
+            lambda fig, ax: draw_value_counts_bar(fig, ax, df[col], col)
+        ), "Nothing meaningful to plot as a bar chart.")
 
     elif chart_type == "Pie":
-        counts = df[col].astype(str).value_counts()
-        if counts.empty or counts.nunique() > 10:
-            st.warning("Pie chart works best for a small number of categories.")
-        else:
-            counts.plot(kind="pie", autopct="%1.1f%%", ax=ax)
-            ax.set_ylabel("")
-            ax.set_title(f"Distribution of {col}")
-            st.pyplot(fig)
+        show_chart(render_chart(
+            (content_hash, "pie", col),
+            lambda fig, ax: draw_pie(fig, ax, df[col], col)
+        ), "Pie chart works best for a small number of categories.")
 
     elif chart_type == "Histogram":
         if pd.api.types.is_numeric_dtype(df[col]):
-            sns.histplot(df[col], kde=True, ax=ax)
-            ax.set_title(f"Histogram of {col}")
-            st.pyplot(fig)
+            show_chart(render_chart(
+                (content_hash, "histogram", col),
+                lambda fig, ax: draw_histogram(fig, ax, df[col], col)
+            ))
         else:
             st.warning("Histogram only works for numeric columns.")
 
     elif chart_type == "Line":
         if pd.api.types.is_numeric_dtype(df[col]):
-            df[col].reset_index(drop=True).plot(kind="line", ax=ax)
-            ax.set_ylabel(col)
-            ax.set_title(f"Line chart of {col}")
-            st.pyplot(fig)
+            # plot over time when the data has dates, else in row order
+            dates = date_columns(df, content_hash)
+            time_axis = None
+            if dates:
+                # dates by default; a saved choice may not fit this data
+                if st.session_state.get(plot_time_key) not in ["Row order"] + dates:
+                    st.session_state[plot_time_key] = dates[0]
+                time_axis = st.selectbox("X axis:", ["Row order"] + dates, key=plot_time_key)
+            if time_axis in dates:
+                show_time_series(df, content_hash, f"{key_prefix}_plot", time_axis, col)
+            else:
+                show_chart(render_chart(
+                    (content_hash, "line", col),
+                    lambda fig, ax: draw_line(fig, ax, range(len(df)), df[col], f"Line chart of {col}", ylabel=col)
+                ))
         else:
             st.warning("Line chart only works for numeric columns.")
 
@@ -92,6 +176,7 @@ def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None):
     cmp_x_key = f"{key_prefix}_cmp_x"
     cmp_y_key = f"{key_prefix}_cmp_y"
     cmp_type_key = f"{key_prefix}_cmp_type"
+    cmp_split_key = f"{key_prefix}_cmp_split"
 
     if initial_config:
         cmp_cfg = initial_config.get("compare", {})
@@ -104,6 +189,9 @@ def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None):
             st.session_state[cmp_y_key] = y_default
         if t_default in ["Scatter", "Line", "Bar", "Correlation"] and cmp_type_key not in st.session_state:
             st.session_state[cmp_type_key] = t_default
+        split_default = cmp_cfg.get("split")
+        if split_default in df.columns and cmp_split_key not in st.session_state:
+            st.session_state[cmp_split_key] = split_default
 
     c1, c2 = st.columns(2)
     x_col = c1.selectbox(
@@ -123,42 +211,72 @@ def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None):
         key=cmp_type_key
     )
 
-    fig, ax = plt.subplots()
-
     if compare_type == "Scatter":
         if pd.api.types.is_numeric_dtype(df[x_col]) and pd.api.types.is_numeric_dtype(df[y_col]):
-            sns.scatterplot(x=df[x_col], y=df[y_col], ax=ax)
-            ax.set_xlabel(x_col)
-            ax.set_ylabel(y_col)
-            ax.set_title(f"{x_col} vs {y_col}")
-            st.pyplot(fig)
+            show_chart(render_chart(
+                (content_hash, "scatter", x_col, y_col),
+                lambda fig, ax: draw_scatter(fig, ax, df[x_col], df[y_col], x_col, y_col)
+            ))
         else:
             st.warning("Scatter comparison works only for numeric columns.")
 
     elif compare_type == "Line":
-        if pd.api.types.is_numeric_dtype(df[x_col]) and pd.api.types.is_numeric_dtype(df[y_col]):
-            df.plot(x=x_col, y=y_col, kind="line", ax=ax)
-            ax.set_title(f"{y_col} over {x_col}")
-            st.pyplot(fig)
+        if x_col in date_columns(df, content_hash) and pd.api.types.is_numeric_dtype(df[y_col]):
+            show_time_series(df, content_hash, f"{key_prefix}_cmp", x_col, y_col)
+        elif pd.api.types.is_numeric_dtype(df[x_col]) and pd.api.types.is_numeric_dtype(df[y_col]):
+            show_chart(render_chart(
+                (content_hash, "compare_line", x_col, y_col),
+                lambda fig, ax: draw_line(
+                    fig, ax, df[x_col], df[y_col], f"{y_col} over {x_col}", xlabel=x_col, label=y_col
+                )
+            ))
         else:
             st.warning("Line comparison works best with numeric columns.")
 
     elif compare_type == "Bar":
-        grouped = (
-            df.groupby(x_col)[y_col]
-            .mean(numeric_only=True)
-            .sort_values(ascending=False)
-            .head(10)
-        )
-        if grouped.empty:
-            st.warning("Bar comparison requires numeric Y and categorical X.")
+        # categorical x axes are answered from the dataset's aggregate cube, built once.
+        # filtered rows get no cube of their own: the chart aggregates just its grouping.
+        cube = None
+        if filters:
+            dims = dimensions(base_df, base_hash)
+            others = [d for d in dims if d != x_col]
         else:
-            grouped.plot(kind="bar", ax=ax)
-            ax.set_xlabel(x_col)
-            ax.set_ylabel(f"Average {y_col}")
-            ax.set_title(f"{y_col} by {x_col}")
-            plt.xticks(rotation=45, ha="right")
-            st.pyplot(fig)
+            cube = cube_cache.get(content_hash)
+            if cube is None:
+                cube = run_in_background(
+                    f"{key_prefix}_cube", ("cube", content_hash),
+                    get_cube, df, content_hash,
+                    label="Aggregating categories..."
+                )
+            dims = cube["dimensions"]
+            others = split_dimensions(cube, x_col)
+        split = None
+        if x_col in dims:
+            if others:
+                if st.session_state.get(cmp_split_key) not in [None] + others:
+                    del st.session_state[cmp_split_key]
+                split = st.selectbox(
+                    "Split by (optional):",
+                    [None] + others,
+                    format_func=lambda c: "—" if c is None else c,
+                    key=cmp_split_key
+                )
+
+        def top_means():
+            if x_col in dims:
+                grouping = (x_col, split) if split else (x_col,)
+                source = cube if cube is not None else grouping_cube(df, grouping, [y_col])
+                grouped = top_groups(source, grouping, y_col)
+            elif pd.api.types.is_numeric_dtype(df[y_col]) and x_col != y_col:
+                grouped = df.groupby(x_col)[y_col].mean().nlargest(10)
+            else:
+                grouped = None
+            return pd.Series(dtype=float) if grouped is None else grouped
+
+        show_chart(render_chart(
+            (content_hash, "compare_bar", x_col, y_col, split),
+            lambda fig, ax: draw_group_bar(fig, ax, top_means(), x_col, y_col, split)
+        ), "Bar comparison requires numeric Y and categorical X.")
 
     elif compare_type == "Correlation":
         numeric_pair = df[[x_col, y_col]].select_dtypes(include="number")
@@ -172,14 +290,17 @@ def analyze_csv(df: pd.DataFrame, key_prefix="default", initial_config=None):
             st.warning("Correlation comparison works only for numeric columns.")
 
     config = {
+        "filters": filters,
         "quick_plot": {
             "column": st.session_state.get(plot_col_key, col),
-            "chart_type": st.session_state.get(plot_type_key, chart_type)
+            "chart_type": st.session_state.get(plot_type_key, chart_type),
+            "time_axis": st.session_state.get(plot_time_key)
         },
         "compare": {
             "x": st.session_state.get(cmp_x_key, x_col),
             "y": st.session_state.get(cmp_y_key, y_col),
-            "comparison_type": st.session_state.get(cmp_type_key, compare_type)
+            "comparison_type": st.session_state.get(cmp_type_key, compare_type),
+            "split": st.session_state.get(cmp_split_key)
         }
     }
     return config
@@ -6,265 +6,519 @@ import uuid
 from datetime import datetime
 import json
 
-from db import get_session, engine, Base
-from models import User, Dataset, AnalysisHistory
+from db import init_db, session_scope
+from models import User, Dataset, DatasetVersion, AnalysisHistory
 from analyzer import analyze_csv
 from cleaner import clean_data
+from history import history_page, release_storage, saved_recipes, schedule_reconcile
+from jobs import run_in_background
+from storage import (
+    save_dataset, save_dataset_chunks, load_shared, load_shared_sample, dataset_cache, enable_copy_on_write, stored_bytes
+)
+from ingest import SAMPLE_ROWS, detect_encoding, should_stream, stream_profile, iter_csv_chunks, source_hash
+from profiler import frame_hash, load_profile, profile_cache, store_profile
+from recipes import derived_hash
+from versions import append_version, dataset_files, prepare_version, prime_caches, stored_files
+from exports import export_panel
+from components.reports import report_panel
+from dtypes import compact_dtypes, format_bytes
+import perf
 
 # intial setup
-# Create database tables if they don't exist
-Base.metadata.create_all(bind=engine)
+# Create database tables if they don't exist (once per process, not every rerun)
+init_db()
+# datasets are shared between sessions through load_shared
+enable_copy_on_write()
 
 # streamlit page setup
 st.set_page_config(page_title="Vizion", page_icon=":bar_chart:", layout="wide")
 st.title("Vizion :bar_chart:")
 
-session = get_session()
-
-params = st.query_params
-if "uid" in params and st.session_state.get("user_id") is None:
-    uid = params["uid"]
-    if isinstance(uid, list):
-        uid = uid[0]
-    user = session.query(User).filter_by(id=uid).first()
-    if user:
-        st.session_state.user_id = user.id
-        st.session_state.email = user.email
-
-st.sidebar.header("Login or Register")
-
-if "user_id" not in st.session_state:
-    st.session_state.user_id = None
-if "email" not in st.session_state:
-    st.session_state.email = None
-
-if st.session_state.user_id is None:
-    tab_login, tab_register = st.sidebar.tabs(["Login", "Register"])
-
-    with tab_register:
-        st.subheader("Create your New Account")
-        name = st.text_input("Full Name")
-        email = st.text_input("Email")
-        pwd = st.text_input("Password", type="password")
-
-        if st.button("Register"):
-            if not name or not email or not pwd:
-                st.error("Please fill empty fields.")
-            else:
-                existing_user = session.query(User).filter_by(email=email).first()
-                if existing_user:
-                    st.error("User with this email already exists.")
-                else:
-                    hashed_pwd = bcrypt.hashpw(
-                        pwd.encode("utf-8"),
-                        bcrypt.gensalt()
-                    ).decode("utf-8")
-                    new_user = User(
-                        id=str(uuid.uuid4()),
-                        name=name,
-                        email=email,
-                        password_hash=hashed_pwd
-                    )
-                    session.add(new_user)
-                    session.commit()
-                    st.success("New account created! You can now log in.")
-
-    with tab_login:
-        st.subheader("Log in to your Account")
-        email_login = st.text_input("Email", key="login_email")
-        pwd_login = st.text_input("Password", type="password", key="login_pwd")
-
-        if st.button("Login"):
-            user = session.query(User).filter_by(email=email_login).first()
-            if user and bcrypt.checkpw(
-                pwd_login.encode("utf-8"),
-                user.password_hash.encode("utf-8")
-            ):
-                st.session_state.user_id = user.id
-                st.session_state.email = user.email
-                st.experimental_set_query_params(uid=user.id)
-                st.success(f"Welcome back, {user.name}!")
-                st.rerun()
-            else:
-                st.error("Invalid email or password.")
 
-if st.session_state.user_id:
-    user = session.query(User).filter_by(id=st.session_state.user_id).first()
-    st.sidebar.write(f"Logged in as: {user.email}")
+def main(session):
+    params = st.query_params
+    if "uid" in params and st.session_state.get("user_id") is None:
+        uid = params["uid"]
+        if isinstance(uid, list):
+            uid = uid[0]
+        user = session.query(User).filter_by(id=uid).first()
+        if user:
+            st.session_state.user_id = user.id
+            st.session_state.email = user.email
 
-    if st.sidebar.button("Logout"):
+    st.sidebar.header("Login or Register")
+
+    if "user_id" not in st.session_state:
         st.session_state.user_id = None
+    if "email" not in st.session_state:
         st.session_state.email = None
-        try:
-            st.query_params.clear()
-        except Exception:
-            st.experimental_set_query_params()
-        st.rerun()
-
-    st.header("Your Analysis History")
-
-    user_analyses = (
-        session.query(AnalysisHistory)
-        .filter_by(user_id=user.id)
-        .order_by(AnalysisHistory.created_at.desc())
-        .all()
-    )
-
-    cleaned_analyses = []
-    dirty = False
-    for a in user_analyses:
-        if a.dataset is None or not os.path.exists(getattr(a.dataset, "storage_path", "")):
-            session.delete(a)
-            dirty = True
-        else:
-            cleaned_analyses.append(a)
-    if dirty:
-        session.commit()
-    user_analyses = cleaned_analyses
-
-    col_hist_left, col_hist_right = st.columns([1, 1])
-    with col_hist_left:
-        if st.button("Clear All History") and user_analyses:
-            session.query(AnalysisHistory).filter_by(user_id=user.id).delete()
-            session.query(Dataset).filter_by(user_id=user.id).delete()
-            session.commit()
-            st.success("All analysis history deleted.")
-            st.rerun()
-    with col_hist_right:
-        pass
-
-    if user_analyses:
-        for a in user_analyses:
-            ds = a.dataset
-            label = ds.filename if ds else "[Missing dataset]"
-            with st.expander(f"{label} — {a.created_at.strftime('%Y-%m-%d %H:%M:%S')}"):
-                st.markdown(f"**Summary:** {a.summary}")
-                c1, c2 = st.columns(2)
-                with c1:
-                    if st.button("Open / Edit", key=f"open_{a.id}"):
-                        st.session_state.editing_analysis_id = a.id
-                        st.rerun()
-                with c2:
-                    if st.button("Delete", key=f"delete_{a.id}"):
-                        session.delete(a)
+
+    if st.session_state.user_id is None:
+        tab_login, tab_register = st.sidebar.tabs(["Login", "Register"])
+
+        with tab_register:
+            st.subheader("Create your New Account")
+            name = st.text_input("Full Name")
+            email = st.text_input("Email")
+            pwd = st.text_input("Password", type="password")
+
+            if st.button("Register"):
+                if not name or not email or not pwd:
+                    st.error("Please fill empty fields.")
+                else:
+                    existing_user = session.query(User).filter_by(email=email).first()
+                    if existing_user:
+                        st.error("User with this email already exists.")
+                    else:
+                        hashed_pwd = bcrypt.hashpw(
+                            pwd.encode("utf-8"),
+                            bcrypt.gensalt()
+                        ).decode("utf-8")
+                        new_user = User(
+                            id=str(uuid.uuid4()),
+                            name=name,
+                            email=email,
+                            password_hash=hashed_pwd
+                        )
+                        session.add(new_user)
                         session.commit()
-                        st.success("Analysis deleted.")
-                        st.rerun()
-    else:
-        st.info("No analysis history found. Upload and analyze a dataset to get started!")
-
-    st.header("Upload your CSV File to Analyze")
-
-    uploaded = st.file_uploader("Choose a CSV file", type=["csv"])
-
-    if uploaded is not None:
-        filename = uploaded.name
-
-        try:
-            uploaded.seek(0)
-        except Exception:
-            pass
-        try:
-            df = pd.read_csv(uploaded)
-        except UnicodeDecodeError:
-            uploaded.seek(0)
-            df = pd.read_csv(uploaded, encoding="latin-1")
-        except Exception as e:
-            st.error(f"Error reading file: {e}")
-            st.stop()
-
-        st.success(f"File '{filename}' uploaded successfully!")
-        st.write("Preview of your file:")
-        st.dataframe(df.head())
-
-        original_csv_bytes = df.to_csv(index=False).encode("utf-8")
-
-        st.download_button(
-            label="💾 Download Original CSV",
-            data=original_csv_bytes,
-            file_name=filename,
-            mime="text/csv"
-        )
-
-        st.header("Analyze this Dataset (Original)")
-        current_config_initial = st.session_state.get("current_viz_config")
-        current_config = analyze_csv(
-            df.copy(),
-            key_prefix="current",
-            initial_config=current_config_initial
-        )
-        st.session_state.current_viz_config = current_config
-
-        if st.button("Save this Analysis"):
-            dataset_id = str(uuid.uuid4())
-            os.makedirs("data", exist_ok=True)
-            dataset_dir = os.path.join("data", dataset_id)
-            os.makedirs(dataset_dir, exist_ok=True)
-            csv_path = os.path.join(dataset_dir, "original.csv")
-            df.to_csv(csv_path, index=False)
-
-            dataset = Dataset(
-                id=dataset_id,
-                user_id=user.id,
-                filename=filename,
-                storage_path=csv_path,
-                row_count=len(df),
-                column_count=len(df.columns),
-                status="Saved",
-                uploaded_at=datetime.utcnow()
-            )
-            session.add(dataset)
-
-            insights_json = json.dumps(current_config) if current_config else None
-            analysis = AnalysisHistory(
-                id=str(uuid.uuid4()),
-                dataset_id=dataset.id,
-                user_id=user.id,
-                created_at=datetime.utcnow(),
-                summary=f"Analyzed '{filename}' with {len(df)} rows and {len(df.columns)} columns.",
-                insights=insights_json
-            )
-            session.add(analysis)
-            session.commit()
-            st.success("Analysis history saved.")
-            st.session_state.editing_analysis_id = analysis.id
-            st.rerun()
+                        st.success("New account created! You can now log in.")
+
+        with tab_login:
+            st.subheader("Log in to your Account")
+            email_login = st.text_input("Email", key="login_email")
+            pwd_login = st.text_input("Password", type="password", key="login_pwd")
+
+            if st.button("Login"):
+                user = session.query(User).filter_by(email=email_login).first()
+                if user and bcrypt.checkpw(
+                    pwd_login.encode("utf-8"),
+                    user.password_hash.encode("utf-8")
+                ):
+                    st.session_state.user_id = user.id
+                    st.session_state.email = user.email
+                    st.experimental_set_query_params(uid=user.id)
+                    st.success(f"Welcome back, {user.name}!")
+                    st.rerun()
+                else:
+                    st.error("Invalid email or password.")
 
-        st.header("Clean your Data (Optional)")
-        cleaned_df = clean_data(df.copy())
-        if not cleaned_df.equals(df):
-            st.header("Analyze Cleaned Data")
-            analyze_csv(cleaned_df, key_prefix="cleaned")
-        else:
-            st.info("Cleaning did not change the data.")
-
-        cleaned_csv_bytes = cleaned_df.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            label="💾 Download Cleaned CSV",
-            data=cleaned_csv_bytes,
-            file_name="cleaned_data.csv",
-            mime="text/csv"
-        )
-
-    editing_id = st.session_state.get("editing_analysis_id")
-    if editing_id:
-        a = session.query(AnalysisHistory).filter_by(id=editing_id, user_id=user.id).first()
-        if not a or not a.dataset or not os.path.exists(a.dataset.storage_path):
-            st.warning("Saved dataset not found for this analysis.")
-        else:
-            st.header(f"Edit Saved Analysis: {a.dataset.filename}")
-            df_edit = pd.read_csv(a.dataset.storage_path)
+    if st.session_state.user_id:
+        user = session.query(User).filter_by(id=st.session_state.user_id).first()
+        st.sidebar.write(f"Logged in as: {user.email}")
+
+        if st.sidebar.button("Logout"):
+            st.session_state.user_id = None
+            st.session_state.email = None
             try:
-                initial_config = json.loads(a.insights) if a.insights else None
+                st.query_params.clear()
             except Exception:
-                initial_config = None
-            new_config = analyze_csv(
-                df_edit,
-                key_prefix=f"edit_{a.id}",
-                initial_config=initial_config
+                st.experimental_set_query_params()
+            st.rerun()
+
+        st.header("Your Analysis History")
+
+        # orphaned analyses are cleaned up by a periodic job instead of checked on every rerun
+        schedule_reconcile()
+
+        # stack of keyset cursors, one per page visited
+        if "history_cursors" not in st.session_state:
+            st.session_state.history_cursors = [None]
+        with perf.span("history page"):
+            user_analyses, next_cursor = history_page(
+                session, user.id, cursor=st.session_state.history_cursors[-1]
             )
-            if st.button("Save Changes", key=f"save_changes_{a.id}"):
-                a.insights = json.dumps(new_config)
+
+        col_hist_left, col_hist_right = st.columns([1, 1])
+        with col_hist_left:
+            if st.button("Clear All History") and user_analyses:
+                datasets = session.query(Dataset).filter_by(user_id=user.id).all()
+                paths = [p for ds in datasets for p in stored_files(ds)]
+                session.query(AnalysisHistory).filter_by(user_id=user.id).delete()
+                session.query(DatasetVersion).filter(
+                    DatasetVersion.dataset_id.in_([ds.id for ds in datasets])
+                ).delete(synchronize_session=False)
+                session.query(Dataset).filter_by(user_id=user.id).delete()
                 session.commit()
-                st.success("Analysis updated.")
+                # files shared with other datasets are kept
+                release_storage(session, paths)
+                st.session_state.history_cursors = [None]
+                st.success("All analysis history deleted.")
+                st.rerun()
+        with col_hist_right:
+            c_prev, c_next = st.columns(2)
+            if c_prev.button("← Newer", disabled=len(st.session_state.history_cursors) == 1):
+                st.session_state.history_cursors.pop()
                 st.rerun()
+            if c_next.button("Older →", disabled=next_cursor is None):
+                st.session_state.history_cursors.append(next_cursor)
+                st.rerun()
+
+        if user_analyses:
+            for a in user_analyses:
+                ds = a.dataset
+                label = ds.filename if ds else "[Missing dataset]"
+                with st.expander(f"{label} — {a.created_at.strftime('%Y-%m-%d %H:%M:%S')}"):
+                    st.markdown(f"**Summary:** {a.summary}")
+                    # datasets already in memory open without reading the file again
+                    resident = None
+                    if ds:
+                        files = dataset_files(ds)
+                        resident = dataset_cache.peek(files[0] if len(files) == 1 else tuple(files))
+                    if resident is not None:
+                        st.caption(f"In memory: {resident.shape[0]:,} rows × {resident.shape[1]} columns")
+                    c1, c2, c3 = st.columns(3)
+                    with c3:
+                        report_panel(a, widget_key=f"report_{a.id}")
+                    with c1:
+                        if st.button("Open / Edit", key=f"open_{a.id}"):
+                            st.session_state.editing_analysis_id = a.id
+                            st.rerun()
+                    with c2:
+                        if st.button("Delete", key=f"delete_{a.id}"):
+                            paths = stored_files(ds) if ds else []
+                            session.delete(a)
+                            # the dataset goes too once no analysis uses it
+                            if ds and not [other for other in ds.analyses if other is not a]:
+                                session.delete(ds)
+                            session.commit()
+                            release_storage(session, paths)
+                            st.success("Analysis deleted.")
+                            st.rerun()
+        else:
+            st.info("No analysis history found. Upload and analyze a dataset to get started!")
+
+        st.header("Upload your CSV File to Analyze")
+
+        uploaded = st.file_uploader("Choose a CSV file", type=["csv"])
+
+        if uploaded is not None:
+            filename = uploaded.name
+
+            encoding = detect_encoding(uploaded)
+            streaming = should_stream(uploaded.size)
+
+            compact = st.sidebar.checkbox(
+                "Compact column types",
+                value=True,
+                help="Downcast numbers, store repeated text as categories and parse dates to save memory."
+            )
+            compaction = None
+
+            if streaming:
+                # large file: profile it chunk by chunk and keep only a bounded row sample
+                stream_key = f"stream_profile_{uploaded.file_id}"
+                if stream_key not in st.session_state:
+                    try:
+                        with st.spinner("Profiling large file in streaming mode..."), perf.span("stream profile"):
+                            streamed = stream_profile(uploaded, encoding=encoding)
+                    except Exception as e:
+                        st.error(f"Error reading file: {e}")
+                        st.stop()
+                    st.session_state[stream_key] = {
+                        "profile": streamed.profile(),
+                        "sample": streamed.sample,
+                        "rows": streamed.rows
+                    }
+                df = st.session_state[stream_key]["sample"]
+                profile = st.session_state[stream_key]["profile"]
+                row_count = st.session_state[stream_key]["rows"]
+                if compact:
+                    # the raw sample is kept too: it is bounded, and getting it back after
+                    # compaction is turned off would mean streaming the whole file again
+                    compacted = st.session_state.get("compacted_sample")
+                    if compacted is None or compacted["file_id"] != uploaded.file_id:
+                        with perf.span("compact dtypes"):
+                            compacted_df, report = compact_dtypes(df)
+                        compacted = {"file_id": uploaded.file_id, "df": compacted_df, "report": report}
+                        st.session_state.compacted_sample = compacted
+                    df, compaction = compacted["df"], compacted["report"]
+            else:
+                # parse once per file and keep one frame for later reruns: the compacted one
+                # when compaction is on, so the raw frame is not held next to it. turning
+                # compaction off parses the file again.
+                loaded = st.session_state.get("uploaded_frame")
+                if loaded is None or loaded["file_id"] != uploaded.file_id or loaded["compact"] != compact:
+                    # let the previous frame go before parsing the next one
+                    st.session_state.pop("uploaded_frame", None)
+                    loaded = None
+                    uploaded.seek(0)
+                    try:
+                        with perf.span("parse csv"):
+                            df = pd.read_csv(uploaded, encoding=encoding)
+                    except UnicodeDecodeError:
+                        uploaded.seek(0)
+                        with perf.span("parse csv"):
+                            df = pd.read_csv(uploaded, encoding="latin-1")
+                    except Exception as e:
+                        st.error(f"Error reading file: {e}")
+                        st.stop()
+                    report = None
+                    if compact:
+                        with perf.span("compact dtypes"):
+                            df, report = compact_dtypes(df)
+                    loaded = {"file_id": uploaded.file_id, "compact": compact, "df": df, "report": report}
+                    st.session_state.uploaded_frame = loaded
+                df, compaction = loaded["df"], loaded["report"]
+                profile = None
+                row_count = len(df)
+
+            if compaction is not None:
+                st.sidebar.caption(
+                    f"Memory: {format_bytes(compaction['before'])} → {format_bytes(compaction['after'])}"
+                )
+
+            # hash the upload once per file instead of on every rerun
+            hash_key = f"content_hash_{uploaded.file_id}_{compact}"
+            if hash_key not in st.session_state:
+                with perf.span("hash"):
+                    st.session_state[hash_key] = frame_hash(df)
+            content_hash = st.session_state[hash_key]
+
+            st.success(f"File '{filename}' uploaded successfully!")
+            if streaming:
+                st.info(
+                    f"Large file ({row_count:,} rows): statistics were computed in streaming mode "
+                    f"and charts use a random sample of {len(df):,} rows."
+                )
+            st.write("Preview of your file:")
+            st.dataframe(df.head())
+
+            if streaming:
+                # only a sample is in memory, hand back the uploaded file as is
+                st.download_button(
+                    label="💾 Download Original CSV",
+                    data=uploaded.getvalue,
+                    file_name=filename,
+                    mime="text/csv"
+                )
+            else:
+                export_panel(
+                    df,
+                    export_key=content_hash,
+                    file_stem=os.path.splitext(filename)[0],
+                    label="💾 Download Original",
+                    widget_key="export_original"
+                )
+
+            st.header("Analyze this Dataset (Original)")
+            current_config_initial = st.session_state.get("current_viz_config")
+            with perf.span("analyze"):
+                current_config = analyze_csv(
+                    df,
+                    key_prefix="current",
+                    initial_config=current_config_initial,
+                    content_hash=content_hash,
+                    profile=profile
+                )
+            st.session_state.current_viz_config = current_config
+
+            if st.button("Save this Analysis"):
+                dataset_id = str(uuid.uuid4())
+                # stored by content: saving data that is already stored only adds a reference
+                try:
+                    with perf.span("save dataset"):
+                        if streaming:
+                            dataset_hash = source_hash(uploaded)
+                            storage_path = save_dataset_chunks(iter_csv_chunks(uploaded, encoding=encoding), dataset_hash)
+                            # the edit view opens it from this profile and a sample
+                            store_profile(dataset_hash, profile)
+                            profile_cache.put(dataset_hash, profile)
+                        else:
+                            dataset_hash = content_hash
+                            storage_path = save_dataset(df, dataset_hash)
+                except Exception as e:
+                    st.error(f"Error saving dataset: {e}")
+                    st.stop()
+
+                dataset = Dataset(
+                    id=dataset_id,
+                    user_id=user.id,
+                    filename=filename,
+                    storage_path=storage_path,
+                    content_hash=dataset_hash,
+                    row_count=row_count,
+                    column_count=len(df.columns),
+                    status="Saved",
+                    uploaded_at=datetime.utcnow()
+                )
+                session.add(dataset)
+
+                if current_config:
+                    # the cleaning recipe is saved with the analysis so it can be replayed later
+                    current_config["cleaning"] = st.session_state.get("current_recipe", [])
+                insights_json = json.dumps(current_config) if current_config else None
+                analysis = AnalysisHistory(
+                    id=str(uuid.uuid4()),
+                    dataset_id=dataset.id,
+                    user_id=user.id,
+                    created_at=datetime.utcnow(),
+                    summary=f"Analyzed '{filename}' with {row_count} rows and {len(df.columns)} columns.",
+                    insights=insights_json
+                )
+                session.add(analysis)
+                session.commit()
+                st.success("Analysis history saved.")
+                st.session_state.editing_analysis_id = analysis.id
+                st.rerun()
+
+            st.header("Clean your Data (Optional)")
+            if streaming:
+                st.info("Cleaning is not available for files profiled in streaming mode.")
+            else:
+                with perf.span("clean"):
+                    cleaned_df, recipe, changed = clean_data(
+                        df,
+                        content_hash=content_hash,
+                        saved_recipes=saved_recipes(session, user.id)
+                    )
+                st.session_state.current_recipe = recipe
+                if changed:
+                    st.header("Analyze Cleaned Data")
+                    with perf.span("analyze cleaned"):
+                        analyze_csv(
+                            cleaned_df,
+                            key_prefix="cleaned",
+                            content_hash=derived_hash(content_hash, recipe)
+                        )
+                else:
+                    st.info("Cleaning did not change the data.")
+
+                export_panel(
+                    cleaned_df,
+                    export_key=derived_hash(content_hash, recipe) if changed else content_hash,
+                    file_stem="cleaned_data",
+                    label="💾 Download Cleaned",
+                    widget_key="export_cleaned"
+                )
+
+        editing_id = st.session_state.get("editing_analysis_id")
+        if editing_id:
+            a = session.query(AnalysisHistory).filter_by(id=editing_id, user_id=user.id).first()
+            if not a or not a.dataset or not all(os.path.exists(p) for p in dataset_files(a.dataset)):
+                st.warning("Saved dataset not found for this analysis.")
+            else:
+                st.header(f"Edit Saved Analysis: {a.dataset.filename}")
+                if a.dataset.versions:
+                    latest = a.dataset.versions[-1]
+                    st.caption(
+                        f"Version {latest.version}: {a.dataset.row_count:,} rows, "
+                        f"{latest.row_count:,} appended {latest.created_at.strftime('%Y-%m-%d %H:%M')}"
+                    )
+                    st.caption(
+                        "Statistics are updated from the appended rows alone: quartiles come from a "
+                        f"random sample of up to {SAMPLE_ROWS:,} rows and distinct counts are estimates."
+                    )
+                with st.expander("Append rows as a new version"):
+                    new_rows = st.file_uploader(
+                        "CSV with the new rows (same columns)", type=["csv"], key=f"append_file_{a.id}"
+                    )
+                    pending_key = f"append_pending_{a.id}"
+                    if new_rows is not None and st.button("Append", key=f"append_{a.id}"):
+                        try:
+                            rows = pd.read_csv(new_rows, encoding=detect_encoding(new_rows))
+                        except (ValueError, pd.errors.ParserError) as e:
+                            st.error(f"Could not append rows: {e}")
+                        else:
+                            # kept until the job is recorded, so an interrupted rerun picks it up again
+                            st.session_state[pending_key] = (new_rows.file_id, a.dataset.content_hash, rows)
+                    if pending_key in st.session_state:
+                        file_id, previous_hash, rows = st.session_state[pending_key]
+                        ds = a.dataset
+                        latest_state = ds.versions[-1].state_path if ds.versions else None
+                        try:
+                            with perf.span("append version"):
+                                prepared = run_in_background(
+                                    f"append_{a.id}", ("append", ds.id, previous_hash, file_id),
+                                    prepare_version, dataset_files(ds), latest_state, previous_hash, rows,
+                                    label="Appending rows..."
+                                )
+                            if ds.content_hash != previous_hash:
+                                raise ValueError("The dataset changed while the rows were being appended, try again.")
+                            version = append_version(session, ds, prepared)
+                            session.commit()
+                        except (ValueError, pd.errors.ParserError) as e:
+                            session.rollback()
+                            del st.session_state[pending_key]
+                            st.error(f"Could not append rows: {e}")
+                        else:
+                            del st.session_state[pending_key]
+                            st.success(f"Added version {version.version} with {version.row_count:,} rows.")
+                            st.rerun()
+                files = dataset_files(a.dataset)
+                # a dataset too large to load opens like a streamed upload: the stored
+                # profile of all rows, and charts from a random sample
+                sampled = should_stream(stored_bytes(files))
+                saved_profile = None
+                if sampled:
+                    with perf.span("load sample"):
+                        df_edit = load_shared_sample(files, SAMPLE_ROWS)
+                    if a.dataset.content_hash:
+                        saved_profile = profile_cache.get(a.dataset.content_hash)
+                        if saved_profile is None:
+                            saved_profile = load_profile(a.dataset.content_hash)
+                    st.info(
+                        f"Large dataset ({a.dataset.row_count or 0:,} rows): "
+                        f"{'statistics cover all rows, ' if saved_profile is not None else ''}"
+                        f"charts use a random sample of {len(df_edit):,} rows."
+                    )
+                else:
+                    with perf.span("load dataset"):
+                        df_edit = load_shared(files)
+                    prime_caches(a.dataset)
+                hash_key = f"content_hash_{a.dataset.id}"
+                if sampled:
+                    # the caches of the sample must not pass for those of the whole dataset
+                    sample_key = f"sample_hash_{a.dataset.id}_{a.dataset.content_hash}"
+                    if sample_key not in st.session_state:
+                        with perf.span("hash"):
+                            st.session_state[sample_key] = frame_hash(df_edit)
+                    st.session_state[hash_key] = st.session_state[sample_key]
+                elif a.dataset.content_hash:
+                    # changes when rows are appended
+                    st.session_state[hash_key] = a.dataset.content_hash
+                elif hash_key not in st.session_state:
+                    # saved before datasets were stored by content
+                    with perf.span("hash"):
+                        st.session_state[hash_key] = frame_hash(df_edit)
+                try:
+                    initial_config = json.loads(a.insights) if a.insights else None
+                except Exception:
+                    initial_config = None
+                with perf.span("analyze saved"):
+                    new_config = analyze_csv(
+                        df_edit,
+                        key_prefix=f"edit_{a.id}",
+                        initial_config=initial_config,
+                        content_hash=st.session_state[hash_key],
+                        profile=saved_profile
+                    )
+                if st.button("Save Changes", key=f"save_changes_{a.id}"):
+                    if initial_config and initial_config.get("cleaning"):
+                        new_config["cleaning"] = initial_config["cleaning"]
+                    a.insights = json.dumps(new_config)
+                    session.commit()
+                    st.success("Analysis updated.")
+                    st.rerun()
+
+                if sampled:
+                    st.caption("Exports are not available for datasets opened from a sample.")
+                else:
+                    export_panel(
+                        df_edit,
+                        export_key=st.session_state[hash_key],
+                        file_stem=os.path.splitext(a.dataset.filename)[0],
+                        label="💾 Export",
+                        widget_key=f"export_{a.id}"
+                    )
+
+        perf.perf_panel()
+
+
+# one database session per script run, closed even when the run is stopped or rerun
+perf.start_run()
+try:
+    with session_scope() as session:
+        main(session)
+finally:
+    perf.finish_run()
@@ -0,0 +1,173 @@
+import argparse
+import glob
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from db import init_db, session_scope
+from dtypes import compact_dtypes
+from ingest import (
+    StreamingProfile, detect_encoding, iter_csv_chunks, profiled, should_stream, source_hash, stream_profile
+)
+from models import AnalysisHistory, Dataset, DatasetProfile, User
+from profiler import _to_json, compute_profile, frame_hash
+from storage import save_dataset, save_dataset_chunks
+
+# profile a directory of csv files across a process pool, store the datasets and
+# record them in the user's history in one transaction:
+#
+#   python batch.py /drops/2024-06-01 --user analyst@example.com --workers 8
+#
+# the saved analyses then open in the app with their profiles already computed.
+
+BATCH_WORKERS = int(os.getenv("VIZION_BATCH_WORKERS", str(os.cpu_count() or 1)))
+
+
+def process_file(path, compact=True):
+    # runs in a worker process: parse, store and profile one csv. returns plain data only,
+    # the parent does all database writes. files are stored by content, so a file seen
+    # before is not written again.
+    started = time.perf_counter()
+    encoding = detect_encoding(path)
+    profile = None
+    if should_stream(os.path.getsize(path)):
+        # too big to load whole: store and profile chunk by chunk in the same read
+        content_hash = source_hash(path)
+        streamed = StreamingProfile()
+        storage_path = save_dataset_chunks(profiled(iter_csv_chunks(path, encoding=encoding), streamed), content_hash)
+        if not streamed.rows:
+            # already stored, so the chunks were never read
+            streamed = stream_profile(path, encoding=encoding)
+        rows, columns = streamed.rows, len(streamed.columns)
+        profile = {name: _to_json(frame) for name, frame in streamed.profile().items()}
+    else:
+        try:
+            df = pd.read_csv(path, encoding=encoding)
+        except UnicodeDecodeError:
+            df = pd.read_csv(path, encoding="latin-1")
+        if compact:
+            df, _ = compact_dtypes(df)
+        # the stored frame loads back with the same hash, so opening the saved analysis
+        # finds the stored profile
+        content_hash = frame_hash(df)
+        storage_path = save_dataset(df, content_hash)
+        rows, columns = df.shape
+        computed = compute_profile(df)
+        profile = {name: _to_json(frame) for name, frame in computed.items()}
+    return {
+        "filename": os.path.basename(path),
+        "storage_path": storage_path,
+        "rows": int(rows),
+        "columns": int(columns),
+        "content_hash": content_hash,
+        "profile": profile,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def record_results(session, user_id, results):
+    # add the dataset, analysis and profile rows of a batch to the session
+    now = datetime.utcnow()
+    hashes = {r["content_hash"] for r in results if r["profile"] is not None}
+    known = set()
+    if hashes:
+        known = {
+            h for (h,) in session.query(DatasetProfile.content_hash)
+            .filter(DatasetProfile.content_hash.in_(hashes))
+        }
+    rows = []
+    for r in results:
+        dataset_id = str(uuid.uuid4())
+        rows.append(Dataset(
+            id=dataset_id,
+            user_id=user_id,
+            filename=r["filename"],
+            storage_path=r["storage_path"],
+            content_hash=r["content_hash"],
+            row_count=r["rows"],
+            column_count=r["columns"],
+            status="Analyzed",
+            uploaded_at=now
+        ))
+        rows.append(AnalysisHistory(
+            id=str(uuid.uuid4()),
+            dataset_id=dataset_id,
+            user_id=user_id,
+            created_at=now,
+            summary=f"Analyzed '{r['filename']}' with {r['rows']} rows and {r['columns']} columns.",
+            insights=None
+        ))
+        h = r["content_hash"]
+        if r["profile"] is not None and h not in known:
+            known.add(h)
+            rows.append(DatasetProfile(content_hash=h, created_at=now, **r["profile"]))
+    session.add_all(rows)
+
+
+def run_batch(directory, user, pattern="*.csv", workers=BATCH_WORKERS, compact=True):
+    # returns the number of files stored and the list of (file, error) that failed
+    init_db()
+    with session_scope() as session:
+        owner = session.query(User).filter((User.id == user) | (User.email == user)).first()
+        if owner is None:
+            raise ValueError(f"Unknown user: {user}")
+        user_id = owner.id
+
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    results, failures = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(process_file, path, compact): path
+            for path in paths
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                r = future.result()
+            except Exception as e:
+                failures.append((path, str(e)))
+                print(f"[{i}/{len(paths)}] {os.path.basename(path)}: failed: {e}", file=sys.stderr, flush=True)
+                continue
+            results.append(r)
+            print(
+                f"[{i}/{len(paths)}] {r['filename']}: {r['rows']:,} rows x {r['columns']} columns "
+                f"in {r['seconds']:.1f}s",
+                flush=True
+            )
+
+    # if this fails, files stored only for this batch are left unreferenced and removed
+    # by the app's periodic storage collection
+    with session_scope() as session:
+        record_results(session, user_id, results)
+        session.commit()
+    return len(results), failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile a directory of CSV files and save them to a user's history.")
+    parser.add_argument("directory")
+    parser.add_argument("--user", required=True, help="id or email of the user the analyses are saved for")
+    parser.add_argument("--pattern", default="*.csv", help="glob of the files to pick up (default: *.csv)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--no-compact", action="store_true", help="keep the dtypes pandas infers")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"not a directory: {args.directory}")
+    try:
+        stored, failures = run_batch(
+            args.directory, args.user, args.pattern, args.workers, compact=not args.no_compact
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Saved {stored} analyses, {len(failures)} failed.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+from matplotlib.figure import Figure
+
+from benchmarks.synthetic import company_performance
+import charts
+import cube
+import dtypes
+import exports
+import filters
+import ingest
+import profiler
+import recipes
+import storage
+import timeseries
+
+# run the compute paths behind the app without a streamlit ui and record the wall time
+# and peak allocation of each stage. each stage runs once untraced for the timing and,
+# unless --no-memory is given, once more for the peaks: python/numpy allocations under
+# tracemalloc, and arrow's own memory pool, which tracemalloc does not see:
+#
+#   python -m benchmarks.run --rows 10000 100000 1000000 --wide 500 --output bench.jsonl
+#
+# results are appended as json lines so runs from different releases can be compared.
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+CLEANING_RECIPE = [{"op": "missing", "strategy": "fill_mean"}, {"op": "drop_duplicates"}]
+
+
+class ArrowPeak:
+    # peak growth of arrow's memory pool while running, polled from a thread: the pool's
+    # own high-water mark covers the whole process and cannot be reset between stages
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _poll(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, pa.total_allocated_bytes() - self.base)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.base = pa.total_allocated_bytes()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, pa.total_allocated_bytes() - self.base)
+
+
+def measure(stage, fn, results, context, reset=None):
+    # reset undoes what the timed run left behind that would make the traced run a no-op,
+    # such as a saved file the second save would reuse
+    start = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - start
+
+    peak_mb = arrow_mb = None
+    if context["trace_memory"]:
+        # tracing slows allocation-heavy code down, so memory gets its own run
+        del value
+        if reset is not None:
+            reset()
+        tracemalloc.start()
+        try:
+            with ArrowPeak() as arrow:
+                value = fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_mb = round(peak / 2**20, 2)
+        arrow_mb = round(arrow.peak / 2**20, 2)
+
+    record = {k: v for k, v in context.items() if k != "trace_memory"}
+    results.append(dict(record, stage=stage, seconds=round(seconds, 4), peak_mb=peak_mb, arrow_peak_mb=arrow_mb))
+    memory = f"{peak_mb:>10.1f} MB {arrow_mb:>10.1f} MB arrow" if peak_mb is not None else ""
+    print(f"  {stage:<22} {seconds:>9.3f}s {memory}", flush=True)
+    return value
+
+
+def render(draw):
+    fig = Figure()
+    ax = fig.subplots()
+    draw(fig, ax)
+    fig.savefig(os.devnull, format="png")
+    fig.clear()
+
+
+def run_case(rows, extra_numeric, workdir, results, label, trace_memory):
+    variant = f"wide{extra_numeric}" if extra_numeric else "base"
+    df = company_performance(rows, extra_numeric=extra_numeric)
+    context = {
+        "label": label,
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "rows": rows,
+        "columns": df.shape[1],
+        "variant": variant,
+        "trace_memory": trace_memory,
+    }
+    print(f"{rows:,} rows x {df.shape[1]} columns ({variant})")
+
+    csv_path = os.path.join(workdir, f"{variant}_{rows}.csv")
+    df.to_csv(csv_path, index=False)
+    del df
+
+    # ingestion
+    df = measure("read_csv", lambda: pd.read_csv(csv_path), results, context)
+    measure("stream_profile", lambda: ingest.stream_profile(csv_path).profile(), results, context)
+    df, _ = measure("compact_dtypes", lambda: dtypes.compact_dtypes(df), results, context)
+
+    # analysis
+    content_hash = measure("frame_hash", lambda: profiler.frame_hash(df), results, context)
+    profile = measure("compute_profile", lambda: profiler.compute_profile(df), results, context)
+    numeric = df.select_dtypes(include="number").columns
+    x_col, y_col = numeric[0], numeric[1]
+    if profile["correlation"] is not None:
+        measure("chart_heatmap", lambda: render(
+            lambda fig, ax: charts.draw_heatmap(fig, ax, profile["correlation"])
+        ), results, context)
+    measure("chart_line", lambda: render(
+        lambda fig, ax: charts.draw_line(fig, ax, range(len(df)), df[y_col], "line")
+    ), results, context)
+    measure("chart_scatter", lambda: render(
+        lambda fig, ax: charts.draw_scatter(fig, ax, df[x_col], df[y_col], x_col, y_col)
+    ), results, context)
+    agg_cube = measure("aggregate_cube", lambda: cube.build_cube(df), results, context)
+    measure("cube_top_groups", lambda: cube.top_groups(agg_cube, ("Department", "Region"), y_col), results, context)
+    dates = timeseries.parsed_dates(df, content_hash, "Date")
+    rollups = measure("time_rollups", lambda: timeseries.build_rollups(df, dates, y_col), results, context)
+    measure("rollup_series", lambda: timeseries.rollup_series(rollups), results, context)
+    # cold indexes and views every time: the caches would otherwise answer the second run
+    row_filters = [
+        {"column": "Region", "values": ["North", "East"]},
+        {"column": y_col, "min": float(df[y_col].median()), "max": float(df[y_col].max())},
+    ]
+    measure("filter_rows", lambda: (
+        filters.filter_cache.clear(), filters.view_cache.clear(), filters.apply_filters(df, content_hash, row_filters)
+    )[-1], results, context)
+    measure("chart_group_bar", lambda: render(
+        lambda fig, ax: charts.draw_group_bar(
+            fig, ax, cube.top_groups(agg_cube, ("Department",), y_col), "Department", y_col
+        )
+    ), results, context)
+
+    # cleaning
+    measure("clean_recipe", lambda: recipes.apply_recipe(df, CLEANING_RECIPE), results, context)
+
+    # save, load and export
+    storage_key = f"bench_{variant}_{rows}"
+    storage_path = measure(
+        "save_dataset", lambda: storage.save_dataset(df, storage_key), results, context,
+        reset=lambda: storage.remove_dataset(storage.dataset_path(storage_key))
+    )
+    measure("load_dataset", lambda: storage.load_dataset(storage_path), results, context)
+    measure("export_csv_gzip", lambda: exports.write_export(
+        df, os.path.join(workdir, f"{content_hash}.csv.gz"), "CSV (gzip)"
+    ), results, context)
+    measure("export_parquet", lambda: exports.write_export(
+        df, os.path.join(workdir, f"{content_hash}.parquet"), "Parquet"
+    ), results, context)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Vizion's ingestion, analysis and cleaning paths.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="row counts to benchmark")
+    parser.add_argument("--wide", type=int, nargs="*", default=[],
+                        help="also run variants with this many extra numeric columns")
+    parser.add_argument("--output", help="append results to this file as json lines")
+    parser.add_argument("--label", default="", help="free-form tag stored with every result, e.g. a release")
+    parser.add_argument("--no-memory", action="store_true", help="only record timings")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="vizion-bench-") as workdir:
+        # keep saved datasets out of the real data folder
+        storage.DATA_DIR = os.path.join(workdir, "data")
+        for rows in args.rows:
+            run_case(rows, 0, workdir, results, args.label, not args.no_memory)
+            for extra in args.wide:
+                run_case(rows, extra, workdir, results, args.label, not args.no_memory)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for record in results:
+                f.write(json.dumps(record) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
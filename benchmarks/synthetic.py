@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+DEPARTMENTS = ["Sales", "HR", "IT", "Finance", "Marketing", "Operations", "Legal", "Support"]
+REGIONS = ["North", "South", "East", "West"]
+
+
+def company_performance(rows: int, extra_numeric=0, missing_rate=0.02, duplicate_rate=0.01, seed=0) -> pd.DataFrame:
+    # a frame shaped like company_performance.csv: a date column, two low-cardinality
+    # text columns and numeric kpis, with missing values and duplicate rows injected.
+    # extra_numeric adds that many sensor-style numeric columns for wide variants.
+    rng = np.random.default_rng(seed)
+    unique_rows = max(rows - int(rows * duplicate_rate), 1)
+
+    dates = pd.date_range("2020-01-01", periods=max(unique_rows // 50, 1), freq="D").strftime("%Y-%m-%d")
+    employees = rng.integers(3, 200, unique_rows)
+    revenue = rng.gamma(2.0, 50000, unique_rows).round(0)
+    expenses = (revenue * rng.uniform(0.4, 0.9, unique_rows)).round(0)
+    df = pd.DataFrame({
+        "Date": rng.choice(dates, unique_rows),
+        "Department": rng.choice(DEPARTMENTS, unique_rows),
+        "Region": rng.choice(REGIONS, unique_rows),
+        "Employees": employees,
+        "Revenue": revenue,
+        "Expenses": expenses,
+        "Profit": revenue - expenses,
+        "Growth_Rate": rng.normal(0.1, 0.05, unique_rows).round(3),
+        "Customer_Satisfaction": rng.uniform(0.6, 1.0, unique_rows).round(2),
+    })
+    if extra_numeric:
+        sensors = pd.DataFrame(
+            rng.normal(0, 1, (unique_rows, extra_numeric)),
+            columns=[f"Sensor_{i:03d}" for i in range(extra_numeric)]
+        )
+        df = pd.concat([df, sensors], axis=1)
+
+    numeric = [c for c in df.columns if c not in ("Date", "Department", "Region", "Employees")]
+    for col in numeric:
+        mask = rng.random(unique_rows) < missing_rate
+        df.loc[mask, col] = np.nan
+
+    duplicates = df.sample(rows - unique_rows, replace=True, random_state=seed) if rows > unique_rows else None
+    if duplicates is not None:
+        df = pd.concat([df, duplicates], ignore_index=True)
+    return df
@@ -0,0 +1,120 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def sizeof(value) -> int:
+    # approximate memory held by a cached value
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True, index=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+# every named cache of the process, for the performance panel
+caches = {}
+
+
+class BoundedCache:
+    # thread-safe lru cache bounded by the total size of its values.
+    # module level instances are shared by every session of the streamlit process.
+
+    def __init__(self, max_bytes: int, name=None):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per key being created, so concurrent misses wait for a single factory call
+        self._creating = {}
+        if name is not None:
+            caches[name] = self
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                # never cache something bigger than the whole budget
+                return
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.current_bytes -= evicted
+                self.evictions += 1
+
+    def get_or_create(self, key, factory):
+        # value for key, calling factory() on a miss. the factory runs outside the
+        # cache lock so a slow computation does not block other keys; callers missing
+        # the same key at the same time wait for the first one instead of repeating it.
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        with self._lock:
+            key_lock = self._creating.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._items.get(key)
+                if entry is not None:
+                    self._items.move_to_end(key)
+                    return entry[0]
+            try:
+                value = factory()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._creating.pop(key, None)
+        return value
+
+    def peek(self, key, default=None):
+        # value for key without counting a hit or refreshing its place in the lru order
+        with self._lock:
+            entry = self._items.get(key)
+            return default if entry is None else entry[0]
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
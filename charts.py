@@ -0,0 +1,137 @@
+import os
+from io import BytesIO
+
+import numpy as np
+import seaborn as sns
+from matplotlib.figure import Figure
+
+import perf
+from cache import BoundedCache
+from correlation import HEATMAP_ANNOTATE_MAX, cluster_order
+from downsample import MAX_PLOT_POINTS, downsample_line, density_grid
+
+# rendered charts shared by every session, keyed by dataset hash, chart type, columns and options
+CHART_CACHE_MB = int(os.getenv("VIZION_CHART_CACHE_MB", "64"))
+chart_cache = BoundedCache(CHART_CACHE_MB * 1024 * 1024, name="charts")
+
+
+def render_chart(key, draw):
+    # png bytes of the chart drawn by draw(fig, ax) plus an optional caption.
+    # key is (dataset hash, chart type, ...).
+    # draw returns False when there is nothing to plot (png is then None) or a caption string.
+    # figures are created without pyplot so nothing stays registered after rendering.
+    def render():
+        fig = Figure()
+        ax = fig.subplots()
+        try:
+            with perf.span(f"render {key[1]} chart"):
+                result = draw(fig, ax)
+                if result is False:
+                    return None, None
+                buf = BytesIO()
+                fig.savefig(buf, format="png", bbox_inches="tight")
+            return buf.getvalue(), result or None
+        finally:
+            fig.clear()
+
+    return chart_cache.get_or_create(key, render)
+
+
+def draw_heatmap(fig, ax, corr):
+    if len(corr.columns) <= HEATMAP_ANNOTATE_MAX:
+        sns.heatmap(corr, annot=True, cmap="Blues", ax=ax)
+        return
+    # too many cells to label: put correlated columns next to each other so blocks show
+    # up, and draw the matrix as one image instead of a mesh of cells
+    order = cluster_order(corr)
+    corr = corr.iloc[order, order]
+    fig.set_size_inches(12, 10)
+    image = ax.imshow(corr.to_numpy(), cmap="Blues", interpolation="nearest", aspect="auto")
+    fig.colorbar(image, ax=ax)
+    ticks = np.arange(0, len(corr), max(1, int(np.ceil(len(corr) / 50))))
+    ax.set_xticks(ticks, corr.columns[ticks], rotation=90, fontsize=6)
+    ax.set_yticks(ticks, corr.index[ticks], fontsize=6)
+    return f"{len(corr)} columns, reordered so that correlated columns sit together."
+
+
+def draw_value_counts_bar(fig, ax, series, col):
+    counts = series.astype(str).value_counts()
+    if counts.empty or counts.nunique() == len(series):
+        return False
+    counts.head(20).plot(kind="bar", ax=ax)
+    ax.set_ylabel("Count")
+    ax.set_title(f"Bar chart of {col}")
+    ax.tick_params(axis="x", labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment("right")
+
+
+def draw_pie(fig, ax, series, col):
+    counts = series.astype(str).value_counts()
+    if counts.empty or counts.nunique() > 10:
+        return False
+    counts.plot(kind="pie", autopct="%1.1f%%", ax=ax)
+    ax.set_ylabel("")
+    ax.set_title(f"Distribution of {col}")
+
+
+def draw_histogram(fig, ax, series, col):
+    sns.histplot(series, kde=True, ax=ax)
+    ax.set_title(f"Histogram of {col}")
+
+
+def draw_line(fig, ax, x, y, title, xlabel=None, ylabel=None, label=None):
+    n = len(y)
+    x, y, downsampled = downsample_line(x, y)
+    ax.plot(x, y, label=label)
+    if xlabel:
+        ax.set_xlabel(xlabel)
+    if ylabel:
+        ax.set_ylabel(ylabel)
+    if label:
+        ax.legend()
+    ax.set_title(title)
+    if downsampled:
+        return f"Downsampled from {n:,} to {len(x):,} points (LTTB)."
+
+
+def draw_time_series(fig, ax, values, measure, date_col, level):
+    # values: averages per period from timeseries.rollup_series, one column per split value
+    if values is None or values.dropna(how="all").empty:
+        return False
+    values.plot(ax=ax, marker="." if len(values) <= 100 else None)
+    ax.set_xlabel(date_col)
+    ax.set_ylabel(f"Average {measure}")
+    ax.set_title(f"{measure} over {date_col}")
+    return f"{level} averages, {len(values):,} periods."
+
+
+def draw_scatter(fig, ax, x, y, x_col, y_col):
+    if len(x) > MAX_PLOT_POINTS:
+        # too many points to draw one by one, show a density map instead
+        counts, x_edges, y_edges = density_grid(x, y)
+        mesh = ax.pcolormesh(x_edges, y_edges, counts.T, cmap="Blues", norm="symlog")
+        fig.colorbar(mesh, ax=ax, label="Rows")
+        caption = f"{len(x):,} points binned into a density map."
+    else:
+        sns.scatterplot(x=x, y=y, ax=ax)
+        caption = None
+    ax.set_xlabel(x_col)
+    ax.set_ylabel(y_col)
+    ax.set_title(f"{x_col} vs {y_col}")
+    return caption
+
+
+def draw_group_bar(fig, ax, grouped, x_col, y_col, split=None):
+    if grouped.empty:
+        return False
+    if split is not None:
+        grouped = grouped.copy()
+        grouped.index = [f"{x} / {s}" for x, s in grouped.index]
+    grouped.plot(kind="bar", ax=ax)
+    ax.set_xlabel(x_col if split is None else f"{x_col} / {split}")
+    ax.set_ylabel(f"Average {y_col}")
+    ax.set_title(f"{y_col} by {x_col}" if split is None else f"{y_col} by {x_col} and {split}")
+    ax.tick_params(axis="x", labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment("right")
@@ -1,46 +1,133 @@
 import pandas as pd
 import streamlit as st
 
-def clean_data(df: pd.DataFrame) -> pd.DataFrame:
+from dedupe import duplicate_count, known_duplicate_count
+from jobs import run_in_background
+from profiler import frame_hash, profile_cache
+from recipes import cached_apply_recipe, derived_hash, is_noop, recipe_key
+
+# sidebar choices and the recipe step each one stands for
+MISSING_OPTIONS = {
+    "Do Nothing": None,
+    "Drop Rows": "drop_rows",
+    "Drop Columns": "drop_columns",
+    "Fill with Mean (Numeric)": "fill_mean",
+    "Fill with Median (Numeric)": "fill_median",
+    "Fill with Mode": "fill_mode",
+}
+MISSING_MESSAGES = {
+    "drop_rows": "Dropped all rows with missing values.",
+    "drop_columns": "Dropped all columns with missing values.",
+    "fill_mean": "Filled missing numeric values with mean.",
+    "fill_median": "Filled missing numeric values with median.",
+    "fill_mode": "Filled missing values with mode.",
+}
+
+def recipe_to_widgets(recipe):
+    # set the sidebar widgets to match a saved recipe
+    strategy = next((step["strategy"] for step in recipe if step["op"] == "missing"), None)
+    st.session_state.clean_option = next(
+        label for label, value in MISSING_OPTIONS.items() if value == strategy
+    )
+    dedupe = next((step for step in recipe if step["op"] == "drop_duplicates"), None)
+    st.session_state.clean_drop_duplicates = dedupe is not None
+    st.session_state.clean_duplicate_subset = list(dedupe.get("subset", [])) if dedupe else []
+
+def _replay_selected(saved_recipes):
+    label = st.session_state.get("replay_recipe")
+    if label in saved_recipes:
+        recipe_to_widgets(saved_recipes[label])
+
+def clean_data(df: pd.DataFrame, content_hash=None, saved_recipes=None):
     # display cleaning options in streamlit streamlit and return the cleaned DataFrame.
+    # the choices become a recipe (see recipes.py) that is applied in the worker pool and
+    # memoized per (dataset, recipe). returns the cleaned frame, the recipe and whether
+    # the recipe changed anything.
 
     st.sidebar.subheader("Data Cleaning Tools")
 
+    if saved_recipes:
+        st.sidebar.selectbox(
+            "Replay a saved cleaning recipe:",
+            ["—"] + list(saved_recipes),
+            key="replay_recipe",
+            on_change=_replay_selected,
+            args=(saved_recipes,)
+        )
+
     # 1. Handle Missing Values
     st.sidebar.subheader("Handle Missing Values")
-    # show total missing values
-    total_missing = df.isna().sum().sum()
+    # show total missing values, from the profile when it is already known
+    if content_hash is None:
+        content_hash = frame_hash(df)
+    profile = profile_cache.get(content_hash)
+    if profile is not None:
+        total_missing = int(profile["missing"]["Missing Count"].sum())
+    else:
+        total_missing = int(df.isna().sum().sum())
     st.sidebar.write(f"Total Missing Values: **{total_missing}**")
 
     clean_option = st.sidebar.radio(
         "Choose how to handle missing values:",
-        ("Do Nothing", "Drop Rows", "Drop Columns", "Fill with Mean (Numeric)", "Fill with Median (Numeric)", "Fill with Mode")
+        list(MISSING_OPTIONS),
+        key="clean_option"
     )
-    if clean_option == "Drop Rows":
-        df = df.dropna()
-        st.sidebar.success("Dropped all rows with missing values.")
-    elif clean_option == "Drop Columns":
-        df = df.dropna(axis=1)
-        st.sidebar.success("Dropped all columns with missing values.")
-    elif clean_option == "Fill with Mean (Numeric)":
-        df = df.fillna(df.mean(numeric_only=True))
-        st.sidebar.success("Filled missing numeric values with mean.")
-    elif clean_option == "Fill with Median (Numeric)":
-        df = df.fillna(df.median(numeric_only=True))
-        st.sidebar.success("Filled missing numeric values with median.")
-    elif clean_option == "Fill with Mode":
-        df = df.fillna(df.mode().iloc[0])
-        st.sidebar.success("Filled missing values with mode.")
+    if MISSING_OPTIONS[clean_option]:
+        st.sidebar.success(MISSING_MESSAGES[MISSING_OPTIONS[clean_option]])
+
+    recipe = []
+    if MISSING_OPTIONS[clean_option]:
+        recipe.append({"op": "missing", "strategy": MISSING_OPTIONS[clean_option]})
 
     # 2. Remove Duplicates
     st.sidebar.subheader("Remove Duplicates")
-    if st.sidebar.button("Remove Duplicates Rows"):
-        before = len(df)
-        df = df.drop_duplicates()
-        after = len(df)
-        st.sidebar.success(f"Removed {before - after} duplicate rows.")
-    
+    # a replayed recipe may name key columns this dataset does not have
+    subset = st.session_state.get("clean_duplicate_subset", [])
+    if any(c not in df.columns for c in subset):
+        st.session_state.clean_duplicate_subset = [c for c in subset if c in df.columns]
+    subset = st.sidebar.multiselect(
+        "Key columns (all columns if empty):",
+        list(df.columns),
+        key="clean_duplicate_subset"
+    )
+    # duplicates are counted on the frame the step will run on, i.e. after missing values
+    # are handled. the count and the duplicate mask are cached, and removal reuses the mask.
+    base_df, base_hash = df, content_hash
+    if not is_noop(recipe, total_missing):
+        base_df, _, _ = run_in_background(
+            "clean_base", ("clean", content_hash, recipe_key(recipe)),
+            cached_apply_recipe, df, content_hash, recipe,
+            label="Cleaning data..."
+        )
+        base_hash = derived_hash(content_hash, recipe)
+    duplicates = known_duplicate_count(base_df, base_hash, subset)
+    if duplicates is None:
+        duplicates = run_in_background(
+            "duplicates", ("duplicates", base_hash, tuple(subset)),
+            duplicate_count, base_df, base_hash, subset,
+            label="Counting duplicate rows..."
+        )
+    st.sidebar.write(f"Duplicate Rows: **{duplicates}**")
+    drop_duplicates = st.sidebar.checkbox("Remove Duplicates Rows", key="clean_drop_duplicates")
+
+    if drop_duplicates:
+        step = {"op": "drop_duplicates"}
+        if subset:
+            step["subset"] = list(subset)
+        recipe.append(step)
+
+    changed = False
+    if not is_noop(recipe, total_missing, duplicates):
+        df, reports, changed = run_in_background(
+            "clean", ("clean", content_hash, recipe_key(recipe)),
+            cached_apply_recipe, df, content_hash, recipe,
+            label="Cleaning data..."
+        )
+        for step, report in zip(recipe, reports):
+            if step["op"] == "drop_duplicates":
+                st.sidebar.success(f"Removed {report['rows_removed']} duplicate rows.")
+
     #  3. Confirm cleaning done
     st.sidebar.markdown("---")
     st.sidebar.info("Cleaning complete. Return to main view to re-analyze your data.")
-    return df
\ No newline at end of file
+    return df, recipe, changed
@@ -0,0 +1,313 @@
+import base64
+import hashlib
+import html
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from charts import (
+    render_chart, draw_heatmap, draw_value_counts_bar, draw_pie,
+    draw_histogram, draw_line, draw_scatter, draw_group_bar, draw_time_series
+)
+from correlation import top_pairs
+from cube import dimensions, get_cube, grouping_cube, split_dimensions, top_groups
+from db import session_scope
+from filters import apply_filters
+from jobs import cancel, check_cancelled, lookup, submit
+from models import AnalysisHistory
+from profiler import get_profile, get_view_profile
+from storage import load_parts
+from timeseries import date_columns, get_rollups, rollup_series
+from versions import dataset_files
+
+# static html reports of saved analyses, one file per dataset content and config
+REPORT_DIR = os.getenv("VIZION_REPORT_DIR", "reports")
+
+STYLE = """
+body { font-family: sans-serif; margin: 2em auto; max-width: 1100px; color: #222; }
+h1 { color: #00ADB5; }
+table { border-collapse: collapse; font-size: 0.85em; margin: 1em 0; }
+th, td { border: 1px solid #ddd; padding: 4px 8px; text-align: right; }
+th { background: #f4f4f4; }
+img { max-width: 100%; }
+.caption, .meta { color: #777; font-size: 0.85em; }
+"""
+
+
+def report_key(content_hash: str, config) -> str:
+    # a report only changes with the data or the saved chart choices
+    text = json.dumps(config or {}, sort_keys=True, default=str)
+    return hashlib.sha256(f"{content_hash}\n{text}".encode("utf-8")).hexdigest()
+
+
+def report_path(key: str) -> str:
+    return os.path.join(REPORT_DIR, f"{key}.html")
+
+
+def _table(frame: pd.DataFrame, index=True) -> str:
+    return frame.to_html(index=index, na_rep="", float_format=lambda v: f"{v:,.4g}", border=0)
+
+
+def _chart(chart, warning=None) -> str:
+    # (png, caption) from render_chart as an inline image
+    png, caption = chart
+    if png is None:
+        return f"<p class='caption'>{html.escape(warning or 'Nothing to plot.')}</p>"
+    data = base64.b64encode(png).decode("ascii")
+    parts = [f"<img src='data:image/png;base64,{data}'>"]
+    if caption:
+        parts.append(f"<p class='caption'>{html.escape(caption)}</p>")
+    return "\n".join(parts)
+
+
+def _time_series(df, content_hash, date_col, measure) -> str:
+    # the whole date range, from the same rollups and chart keys as the live page
+    rollups = get_rollups(df, content_hash, date_col, measure)
+    if rollups["start"] is None:
+        return f"<p class='caption'>No valid dates in {html.escape(str(date_col))}.</p>"
+    start, end = rollups["start"].date(), rollups["end"].date()
+    values, level = rollup_series(rollups, start, end)
+    return _chart(render_chart(
+        (content_hash, "time_series", date_col, measure, None, start, end),
+        lambda fig, ax: draw_time_series(fig, ax, values, measure, date_col, level)
+    ), "No values to plot.")
+
+
+def _quick_plot(df, content_hash, qp) -> str:
+    col, chart_type = qp.get("column"), qp.get("chart_type")
+    if col not in df.columns:
+        return ""
+    numeric = pd.api.types.is_numeric_dtype(df[col])
+    if chart_type == "Bar":
+        return _chart(render_chart(
+            (content_hash, "bar", col),
+            lambda fig, ax: draw_value_counts_bar(fig, ax, df[col], col)
+        ), "Nothing meaningful to plot as a bar chart.")
+    if chart_type == "Pie":
+        return _chart(render_chart(
+            (content_hash, "pie", col),
+            lambda fig, ax: draw_pie(fig, ax, df[col], col)
+        ), "Pie chart works best for a small number of categories.")
+    if chart_type == "Histogram" and numeric:
+        return _chart(render_chart(
+            (content_hash, "histogram", col),
+            lambda fig, ax: draw_histogram(fig, ax, df[col], col)
+        ))
+    if chart_type == "Line" and numeric:
+        dates = date_columns(df, content_hash)
+        time_axis = qp.get("time_axis")
+        if time_axis is None and dates:
+            time_axis = dates[0]
+        if time_axis in dates:
+            return _time_series(df, content_hash, time_axis, col)
+        return _chart(render_chart(
+            (content_hash, "line", col),
+            lambda fig, ax: draw_line(fig, ax, range(len(df)), df[col], f"Line chart of {col}", ylabel=col)
+        ))
+    return ""
+
+
+def _compare(df, content_hash, cmp, filtered=False, job=None) -> str:
+    x_col, y_col, compare_type = cmp.get("x"), cmp.get("y"), cmp.get("comparison_type")
+    if x_col not in df.columns or y_col not in df.columns:
+        return ""
+    numeric_x = pd.api.types.is_numeric_dtype(df[x_col])
+    numeric_y = pd.api.types.is_numeric_dtype(df[y_col])
+    if compare_type == "Scatter" and numeric_x and numeric_y:
+        return _chart(render_chart(
+            (content_hash, "scatter", x_col, y_col),
+            lambda fig, ax: draw_scatter(fig, ax, df[x_col], df[y_col], x_col, y_col)
+        ))
+    if compare_type == "Line":
+        if x_col in date_columns(df, content_hash) and numeric_y:
+            return _time_series(df, content_hash, x_col, y_col)
+        if numeric_x and numeric_y:
+            return _chart(render_chart(
+                (content_hash, "compare_line", x_col, y_col),
+                lambda fig, ax: draw_line(
+                    fig, ax, df[x_col], df[y_col], f"{y_col} over {x_col}", xlabel=x_col, label=y_col
+                )
+            ))
+    if compare_type == "Bar":
+        # like the live page, filtered rows only aggregate the grouping the chart shows
+        if filtered:
+            cube = None
+            dims = dimensions(df, content_hash)
+            others = [d for d in dims if d != x_col]
+        else:
+            cube = get_cube(df, content_hash, job=job)
+            dims = cube["dimensions"]
+            others = split_dimensions(cube, x_col)
+        split = cmp.get("split") if x_col in dims else None
+        if split not in others:
+            split = None
+
+        def top_means():
+            if x_col in dims:
+                grouping = (x_col, split) if split else (x_col,)
+                source = cube if cube is not None else grouping_cube(df, grouping, [y_col])
+                grouped = top_groups(source, grouping, y_col)
+            elif numeric_y and x_col != y_col:
+                grouped = df.groupby(x_col)[y_col].mean().nlargest(10)
+            else:
+                grouped = None
+            return pd.Series(dtype=float) if grouped is None else grouped
+
+        return _chart(render_chart(
+            (content_hash, "compare_bar", x_col, y_col, split),
+            lambda fig, ax: draw_group_bar(fig, ax, top_means(), x_col, y_col, split)
+        ), "Bar comparison requires numeric Y and categorical X.")
+    if compare_type == "Correlation":
+        pair = df[[x_col, y_col]].select_dtypes(include="number")
+        if pair.shape[1] == 2:
+            corr = pair.corr().iloc[0, 1]
+            return f"<p>Correlation between {html.escape(str(x_col))} and {html.escape(str(y_col))}: <b>{corr:.3f}</b></p>"
+    return ""
+
+
+def _describe_filters(filters) -> str:
+    if not filters:
+        return ""
+    parts = [
+        f"{f['column']} in {', '.join(map(str, f['values']))}" if "values" in f
+        else f"{f['column']} {f['min']} – {f['max']}"
+        for f in filters
+    ]
+    return html.escape(", filtered to " + "; ".join(parts))
+
+
+def build_report(df: pd.DataFrame, content_hash: str, config, title: str, job=None) -> str:
+    # self-contained html page with the statistics and the charts of a saved analysis.
+    # charts go through the chart cache of the process building the report: the reports
+    # pool runs in worker processes, so charts already drawn on a live page are drawn
+    # again, and only charts shared with earlier reports of the same worker are reused.
+    config = config or {}
+    filtered = bool(config.get("filters"))
+    df, content_hash = apply_filters(df, content_hash, config.get("filters"))
+    if job is not None:
+        job.report(0.0, "Computing summary statistics...")
+    profile = get_view_profile(df, content_hash) if filtered else get_profile(df, content_hash)
+    check_cancelled(job)
+
+    body = [
+        f"<h1>{html.escape(title)}</h1>",
+        f"<p class='meta'>{len(df):,} rows × {df.shape[1]} columns{_describe_filters(config.get('filters'))} · "
+        f"generated {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC</p>",
+        "<h2>Summary Statistics</h2>", _table(profile["summary"]),
+        "<h2>Missing Values</h2>", _table(profile["missing"], index=False),
+    ]
+    if profile["correlation"] is not None:
+        if job is not None:
+            job.report(0.4, "Drawing correlation heatmap...")
+        body += [
+            "<h2>Correlation Heatmap</h2>",
+            _chart(render_chart(
+                (content_hash, "heatmap"),
+                lambda fig, ax: draw_heatmap(fig, ax, profile["correlation"])
+            )),
+            "<h3>Strongest correlations</h3>", _table(top_pairs(profile["correlation"]), index=False),
+        ]
+    check_cancelled(job)
+
+    if job is not None:
+        job.report(0.6, "Drawing charts...")
+    quick = _quick_plot(df, content_hash, config.get("quick_plot") or {})
+    if quick:
+        body += ["<h2>Quick Plot</h2>", quick]
+    check_cancelled(job)
+    compare = _compare(df, content_hash, config.get("compare") or {}, filtered=filtered, job=job)
+    if compare:
+        body += ["<h2>Compare Two Columns</h2>", compare]
+
+    recipe = config.get("cleaning")
+    if recipe:
+        steps = "".join(f"<li>{html.escape(json.dumps(step))}</li>" for step in recipe)
+        body += ["<h2>Cleaning Recipe</h2>", f"<ol>{steps}</ol>"]
+
+    return (
+        "<!DOCTYPE html>\n<html><head><meta charset='utf-8'>"
+        f"<title>{html.escape(title)}</title><style>{STYLE}</style></head>\n"
+        "<body>\n" + "\n".join(body) + "\n</body></html>\n"
+    )
+
+
+def write_report(paths, content_hash, config, title, analysis_id, job=None) -> str:
+    # build the report of a stored dataset into the report folder, record it on the
+    # analysis and return its path. runs in the reports process pool: the dataset is
+    # loaded there without going through the dataset cache of the page server.
+    key = report_key(content_hash, config)
+    path = report_path(key)
+    if not os.path.exists(path):
+        if job is not None:
+            job.report(0.0, "Loading dataset...")
+        df = load_parts(paths)
+        page = build_report(df, content_hash, config, title, job=job)
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(page)
+        os.replace(tmp, path)
+    with session_scope() as session:
+        session.query(AnalysisHistory).filter_by(id=analysis_id).update({"report_key": key})
+        session.commit()
+    return path
+
+
+def _read_report(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def report_panel(analysis, widget_key):
+    # build / download buttons for the report of a saved analysis. the build runs in the
+    # reports pool without blocking the page; the analysis records the report it has, so
+    # only the file of its current report is looked up.
+    ds = analysis.dataset
+    if ds is None:
+        return
+    if not ds.content_hash:
+        st.caption("Save this dataset again to build a report.")
+        return
+    try:
+        config = json.loads(analysis.insights) if analysis.insights else {}
+    except ValueError:
+        config = {}
+    key = report_key(ds.content_hash, config)
+    path = report_path(key)
+
+    # the file may have been removed since, e.g. with the report folder cleaned
+    ready = analysis.report_key == key and os.path.exists(path)
+    entry = None if ready else lookup(("report", key))
+    if entry is not None:
+        future, job = entry
+        if not future.done():
+            # built in a worker process, which reports no progress
+            st.caption(job.message)
+            return
+        if future.exception() is not None:
+            st.error(f"Report failed: {future.exception()}")
+        else:
+            # the worker recorded it after this page loaded the analysis
+            ready = True
+    if ready:
+        st.download_button(
+            "📄 Download Report",
+            data=lambda: _read_report(path),
+            file_name=f"{os.path.splitext(ds.filename)[0]}_report.html",
+            mime="text/html",
+            key=widget_key
+        )
+        return
+
+    if st.button("📄 Build Report", key=widget_key):
+        title = f"Analysis of {ds.filename}"
+        cancel(("report", key))  # a failed earlier attempt
+        submit(
+            ("report", key), write_report, dataset_files(ds), ds.content_hash, config, title, analysis.id,
+            label="Building report...", pool="reports"
+        )
+        st.rerun()
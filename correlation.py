@@ -0,0 +1,119 @@
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from jobs import check_cancelled
+
+# columns per block: the matrix is built from block-by-block products so the row-sized
+# temporaries stay small and a background job can report progress and be cancelled
+BLOCK_COLUMNS = int(os.getenv("VIZION_CORR_BLOCK_COLUMNS", "256"))
+# above this many columns the heatmap is clustered and drawn without annotations
+HEATMAP_ANNOTATE_MAX = int(os.getenv("VIZION_HEATMAP_ANNOTATE_MAX", "20"))
+# strongest pairs listed next to the heatmap
+TOP_PAIRS = 20
+
+
+def _block_corr(xa, ma, xb, mb):
+    # pearson correlation between the columns of two blocks over the rows where both
+    # values are present. x holds centered values with missing ones set to 0, m is 1 where
+    # a value is present, so every sum below only counts rows present in both columns.
+    n = ma.T @ mb
+    sa = xa.T @ mb
+    sb = ma.T @ xb
+    saa = (xa * xa).T @ mb
+    sbb = ma.T @ (xb * xb)
+    sab = xa.T @ xb
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sab - sa * sb / n
+        var_a = saa - sa * sa / n
+        var_b = sbb - sb * sb / n
+        r = cov / np.sqrt(var_a * var_b)
+    r[(n < 2) | (var_a <= 0) | (var_b <= 0)] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+
+def pairwise_corr(values: np.ndarray, block=BLOCK_COLUMNS, job=None, progress=(0.0, 1.0)) -> np.ndarray:
+    # pearson correlation matrix of the columns of a 2d float array, with missing values
+    # excluded pair by pair like DataFrame.corr(). progress is the part of the job's
+    # progress bar this covers.
+    values = np.asarray(values, dtype=np.float64)
+    n, p = values.shape
+    present = ~np.isnan(values)
+    complete = bool(present.all())
+    # centering first keeps the one-pass sums accurate for columns with large offsets
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-missing columns
+        means = np.nanmean(values, axis=0)
+    x = np.where(present, values - np.nan_to_num(means), 0.0)
+    if complete:
+        norms = np.sqrt((x * x).sum(axis=0))
+    else:
+        m = present.astype(np.float64)
+    del present
+
+    out = np.empty((p, p))
+    starts = range(0, p, block)
+    total = len(starts) * (len(starts) + 1) // 2
+    done = 0
+    for i in starts:
+        for j in range(i, p, block):
+            a, b = slice(i, i + block), slice(j, j + block)
+            if complete:
+                # no missing values: one product and the column norms are enough
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    r = np.clip((x[:, a].T @ x[:, b]) / np.outer(norms[a], norms[b]), -1.0, 1.0)
+                if n < 2:
+                    r[:] = np.nan
+            else:
+                r = _block_corr(x[:, a], m[:, a], x[:, b], m[:, b])
+            out[a, b] = r
+            out[b, a] = r.T
+            done += 1
+            if job is not None:
+                job.report(progress[0] + (progress[1] - progress[0]) * done / total, "Computing correlations...")
+            check_cancelled(job)
+    # a column correlates perfectly with itself whenever it varies
+    diagonal = np.diagonal(out).copy()
+    np.fill_diagonal(out, np.where(np.isnan(diagonal), np.nan, 1.0))
+    return out
+
+
+def correlation_matrix(df: pd.DataFrame, job=None, progress=(0.0, 1.0)):
+    # correlation matrix of the numeric columns of df, or None with fewer than two
+    numeric = df.select_dtypes(include="number")
+    if numeric.shape[1] < 2:
+        return None
+    values = numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+    corr = pairwise_corr(values, job=job, progress=progress)
+    return pd.DataFrame(corr, index=numeric.columns, columns=numeric.columns)
+
+
+def top_pairs(corr: pd.DataFrame, k=TOP_PAIRS) -> pd.DataFrame:
+    # the k column pairs with the largest absolute correlation
+    values = corr.to_numpy()
+    rows, cols = np.triu_indices(len(values), k=1)
+    r = values[rows, cols]
+    keep = ~np.isnan(r)
+    rows, cols, r = rows[keep], cols[keep], r[keep]
+    if len(r) > k:
+        best = np.argpartition(-np.abs(r), k - 1)[:k]
+        rows, cols, r = rows[best], cols[best], r[best]
+    order = np.argsort(-np.abs(r), kind="stable")
+    return pd.DataFrame({
+        "Column A": corr.index[rows[order]],
+        "Column B": corr.columns[cols[order]],
+        "Correlation": r[order],
+    })
+
+
+def cluster_order(corr: pd.DataFrame) -> np.ndarray:
+    # column order that places strongly correlated columns next to each other: sort by
+    # the angle of each column in the plane of the two leading eigenvectors of |corr|
+    a = np.nan_to_num(np.abs(corr.to_numpy()))
+    if len(a) < 3:
+        return np.arange(len(a))
+    _, vectors = np.linalg.eigh(a)
+    v1, v2 = vectors[:, -1], vectors[:, -2]
+    return np.argsort(np.arctan2(v2, v1), kind="stable")
@@ -0,0 +1,153 @@
+import os
+from itertools import combinations
+
+import pandas as pd
+
+from cache import BoundedCache
+from jobs import check_cancelled
+
+# text / categorical columns with at most this many distinct values are cube dimensions
+CUBE_MAX_CARDINALITY = int(os.getenv("VIZION_CUBE_MAX_CARDINALITY", "1000"))
+# pairs of dimensions are only combined while they can have at most this many groups
+CUBE_MAX_GROUPS = int(os.getenv("VIZION_CUBE_MAX_GROUPS", "20000"))
+# per-group statistics kept for every measure; the mean is sum / count
+CUBE_STATS = ["count", "sum", "min", "max"]
+
+# cubes per dataset hash, shared by every session
+cube_cache = BoundedCache(int(os.getenv("VIZION_CUBE_CACHE_MB", "64")) * 1024 * 1024, name="cubes")
+
+
+def _is_dimension_dtype(s: pd.Series) -> bool:
+    return (
+        isinstance(s.dtype, pd.CategoricalDtype)
+        or pd.api.types.is_bool_dtype(s)
+        or pd.api.types.is_object_dtype(s)
+        or pd.api.types.is_string_dtype(s)
+    )
+
+
+def measure_columns(df: pd.DataFrame):
+    return [
+        c for c in df.columns
+        if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])
+    ]
+
+
+def dimension_cardinality(df: pd.DataFrame) -> dict:
+    # number of distinct values of every column usable as a dimension
+    cardinality = {}
+    for c in df.columns:
+        if not _is_dimension_dtype(df[c]):
+            continue
+        n = df[c].nunique(dropna=True)
+        if 0 < n <= CUBE_MAX_CARDINALITY:
+            cardinality[c] = n
+    return cardinality
+
+
+def dimensions(df: pd.DataFrame, content_hash: str):
+    # the dimension columns of a dataset, from its cube when that is built
+    cube = cube_cache.get(content_hash)
+    if cube is not None:
+        return cube["dimensions"]
+    return cube_cache.get_or_create(("dimensions", content_hash), lambda: list(dimension_cardinality(df)))
+
+
+def category_keys(df: pd.DataFrame, columns) -> dict:
+    # grouping by category codes is much faster than hashing the strings every time
+    return {
+        c: df[c] if isinstance(df[c].dtype, pd.CategoricalDtype) else df[c].astype("category")
+        for c in columns
+    }
+
+
+def build_cube(df: pd.DataFrame, job=None) -> dict:
+    # count / sum / min / max of every numeric column per value of every low-cardinality
+    # categorical column, and per pair of them. returns
+    #   {"dimensions": [...], "measures": [...], "tables": {(dim,) or (dim, dim): frame}}
+    # where each frame is indexed by the dimension values with (measure, stat) columns.
+    measures = measure_columns(df)
+    cardinality = dimension_cardinality(df)
+    dimensions = list(cardinality)
+    keys = category_keys(df, dimensions)
+
+    groupings = [(d,) for d in dimensions] + [
+        pair for pair in combinations(dimensions, 2)
+        if cardinality[pair[0]] * cardinality[pair[1]] <= CUBE_MAX_GROUPS
+    ]
+    tables = _aggregate(df[measures], keys, groupings, job=job)
+    return {"dimensions": dimensions, "measures": measures, "tables": tables}
+
+
+def _aggregate(values: pd.DataFrame, keys: dict, groupings, job=None) -> dict:
+    tables = {}
+    for i, dims in enumerate(groupings):
+        if job is not None:
+            job.report(i / len(groupings), f"Aggregating by {' × '.join(map(str, dims))}...")
+        grouped = values.groupby([keys[d] for d in dims], observed=True)
+        tables[dims] = grouped.agg(CUBE_STATS) if values.shape[1] else grouped.size().to_frame("count")
+        check_cancelled(job)
+    return tables
+
+
+def merge_cube(cube: dict, df: pd.DataFrame, job=None) -> dict:
+    # cube of the rows the cube was built from followed by the rows of df, computed from
+    # the cube and df alone: counts and sums add up, minimums and maximums combine.
+    # df is aggregated over the cube's own dimensions and measures.
+    measures = cube["measures"]
+    values = df[measures].apply(pd.to_numeric, errors="coerce") if measures else df[[]]
+    keys = category_keys(df, cube["dimensions"])
+    delta = _aggregate(values, keys, list(cube["tables"]), job=job)
+    tables = {}
+    for dims, table in cube["tables"].items():
+        combined = pd.concat([table, delta[dims]])
+        how = {
+            c: "sum" if (c[-1] if isinstance(c, tuple) else c) in ("count", "sum") else c[-1]
+            for c in combined.columns
+        }
+        tables[dims] = combined.groupby(level=list(range(combined.index.nlevels)), sort=False).agg(how)
+    return {"dimensions": cube["dimensions"], "measures": measures, "tables": tables}
+
+
+def grouping_cube(df: pd.DataFrame, dims, measures) -> dict:
+    # a cube holding only the table of dims, for a one-off aggregate such as a chart of
+    # filtered rows, where building every table of a full cube would be wasted
+    dims = tuple(dims)
+    measures = [m for m in measures if m in measure_columns(df)]
+    tables = _aggregate(df[measures], category_keys(df, dims), [dims])
+    return {"dimensions": list(dims), "measures": measures, "tables": tables}
+
+
+def get_cube(df: pd.DataFrame, content_hash: str, job=None) -> dict:
+    # build_cube memoized per dataset
+    return cube_cache.get_or_create(content_hash, lambda: build_cube(df, job=job))
+
+
+def split_dimensions(cube: dict, dim):
+    # the dimensions dim can be split by: those it has a pair table with. pairs with more
+    # than CUBE_MAX_GROUPS possible groups are not aggregated.
+    tables = cube["tables"]
+    return [d for d in cube["dimensions"] if d != dim and ((dim, d) in tables or (d, dim) in tables)]
+
+
+def top_groups(cube: dict, dims, measure, n=10, stat="mean"):
+    # the n groups of dims with the largest stat of measure, read from the cube.
+    # None when the cube has no table for these dimensions or measure.
+    dims = tuple(dims)
+    table = cube["tables"].get(dims)
+    swapped = False
+    if table is None and len(dims) == 2:
+        table = cube["tables"].get(dims[::-1])
+        swapped = True
+    if table is None or measure not in cube["measures"]:
+        return None
+    stats = table[measure]
+    if stat == "mean":
+        result = stats["sum"] / stats["count"].where(stats["count"] > 0)
+    else:
+        result = stats[stat]
+    if swapped:
+        result = result.swaplevel()
+    result = result.dropna().nlargest(n)
+    result.name = measure
+    return result
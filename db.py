@@ -1,23 +1,125 @@
 import os 
-from sqlalchemy import create_engine 
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 
+import perf
+
 load_dotenv()
 # get the database url from environment variable or use default sqlite
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///vizion.db")
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# sqlite tuning: WAL lets readers run alongside a writer, NORMAL sync is safe with WAL,
+# and the busy timeout makes concurrent writers wait instead of failing with "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _engine_options():
+    if IS_SQLITE:
+        return {"connect_args": {"check_same_thread": False}}
+    # connection pool for server databases such as postgres
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True,
+    }
+
 
 # database engine - main connection to the database
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-                       )
+engine = create_engine(DATABASE_URL, **_engine_options())
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+
+# time every statement for the performance panel and the slow query log
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    perf.record_query(statement, time.perf_counter() - started)
+
+
+@event.listens_for(engine, "handle_error")
+def _drop_query_timer(exception_context):
+    # a failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
 
 # session factory - creates new sessions for interacting with the database
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # base class for declarative models
 Base = declarative_base()
 
+_initialized = False
+_init_lock = threading.Lock()
+
+
+# Add columns introduced after a table was first created. create_all only creates
+# missing tables, so new columns (which must be nullable) are added with ALTER TABLE.
+def _add_missing_columns():
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+
+
+# Create tables and indexes, once per process
+def init_db():
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        import models  # noqa: F401 - registers the tables on Base
+        Base.metadata.create_all(bind=engine)
+        _add_missing_columns()
+        # create indexes added after the tables were first created
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        _initialized = True
+
+
 # Helper function to get a new database session
 def get_session():
-    return SessionLocal()
\ No newline at end of file
+    return SessionLocal()
+
+
+# Session for one unit of work: rolled back on error and always closed
+@contextmanager
+def session_scope():
+    session = SessionLocal()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import BoundedCache
+
+# 64-bit row fingerprints per (frame hash, key columns), and the duplicate mask computed
+# from them, shared by every session.
+# rows with equal fingerprints are treated as duplicates; with 64-bit hashes a false match
+# is vanishingly unlikely even for tens of millions of rows.
+fingerprint_cache = BoundedCache(int(os.getenv("VIZION_FINGERPRINT_CACHE_MB", "128")) * 1024 * 1024, name="fingerprints")
+
+
+def _subset_key(df: pd.DataFrame, subset):
+    # the key columns that exist in df, as a cache key part. None means the whole row.
+    if not subset:
+        return None
+    columns = tuple(c for c in subset if c in df.columns)
+    if not columns or len(columns) == df.shape[1]:
+        return None
+    return columns
+
+
+def row_fingerprints(df: pd.DataFrame, content_hash=None, subset=None) -> np.ndarray:
+    # one uint64 hash per row of df (or of its subset columns), cached when the frame's
+    # content hash is given
+    columns = _subset_key(df, subset)
+
+    def compute():
+        frame = df if columns is None else df[list(columns)]
+        return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+    if content_hash is None:
+        return compute()
+    return fingerprint_cache.get_or_create((content_hash, columns), compute)
+
+
+def _duplicates(df, content_hash, subset):
+    # (mask of the rows repeating an earlier row, their count), cached next to the
+    # fingerprints when the frame's content hash is given
+    columns = _subset_key(df, subset)
+
+    def compute():
+        fingerprints = row_fingerprints(df, content_hash, subset)
+        mask = pd.Series(fingerprints, copy=False).duplicated().to_numpy()
+        return mask, int(mask.sum())
+
+    if content_hash is None:
+        return compute()
+    return fingerprint_cache.get_or_create((content_hash, columns, "dup"), compute)
+
+
+def duplicate_mask(df: pd.DataFrame, content_hash=None, subset=None) -> np.ndarray:
+    # true for every row that repeats an earlier row (on the subset columns)
+    return _duplicates(df, content_hash, subset)[0]
+
+
+def duplicate_count(df: pd.DataFrame, content_hash=None, subset=None, job=None) -> int:
+    return _duplicates(df, content_hash, subset)[1]
+
+
+def known_duplicate_count(df: pd.DataFrame, content_hash, subset=None):
+    # the duplicate count when it is already cached, else None
+    cached = fingerprint_cache.get((content_hash, _subset_key(df, subset), "dup"))
+    return None if cached is None else cached[1]
+
+
+def drop_duplicates(df: pd.DataFrame, content_hash=None, subset=None) -> pd.DataFrame:
+    # df without repeated rows, keeping the first occurrence like DataFrame.drop_duplicates
+    mask = duplicate_mask(df, content_hash, subset)
+    if not mask.any():
+        return df
+    return df[~mask]
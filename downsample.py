@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# line and scatter charts with more points than this are downsampled before plotting
+MAX_PLOT_POINTS = int(os.getenv("VIZION_MAX_PLOT_POINTS", "5000"))
+# grid size used when a scatter plot is rasterized into a density map
+DENSITY_BINS = int(os.getenv("VIZION_DENSITY_BINS", "200"))
+
+
+def lttb(x, y, n_out: int):
+    # largest-triangle-three-buckets: keep the n_out points that best preserve the
+    # visual shape of the series. x and y are numpy arrays without missing values.
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # first and last points are always kept, the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket is the third corner of the triangle
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bx = x[start:end]
+        by = y[start:end]
+        area = np.abs((x[a] - avg_x) * (by - y[a]) - (x[a] - bx) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+
+    return x[keep], y[keep]
+
+
+def _floats(values) -> np.ndarray:
+    # float64 array with missing values as nan; np.asarray fails on pd.NA in nullable
+    # Int64 / Float64 columns
+    return pd.Series(values).to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def downsample_line(x, y, max_points=MAX_PLOT_POINTS):
+    # returns (x, y, applied); rows with a missing x or y are dropped before downsampling
+    x = _floats(x)
+    y = _floats(y)
+    if len(y) <= max_points:
+        # few enough to draw as is; missing values show as gaps
+        return x, y, False
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    x_out, y_out = lttb(x, y, max_points)
+    return x_out, y_out, len(y_out) < len(y)
+
+
+def density_grid(x, y, bins=DENSITY_BINS):
+    # 2-d histogram of the points, returns (counts, x_edges, y_edges)
+    x = _floats(x)
+    y = _floats(y)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    counts, x_edges, y_edges = np.histogram2d(x[valid], y[valid], bins=bins)
+    return counts, x_edges, y_edges
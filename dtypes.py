@@ -0,0 +1,94 @@
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# text columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_RATIO = float(os.getenv("VIZION_CATEGORY_MAX_RATIO", "0.5"))
+# values tried when deciding whether a text column holds dates
+DATE_SAMPLE_SIZE = 1000
+
+
+def _is_text(s: pd.Series) -> bool:
+    return (
+        not isinstance(s.dtype, pd.CategoricalDtype)
+        and (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s))
+    )
+
+
+def looks_like_dates(s: pd.Series) -> bool:
+    # true if every sampled value of the column parses as a date
+    sample = s.dropna().head(DATE_SAMPLE_SIZE)
+    if sample.empty:
+        return False
+    with warnings.catch_warnings():
+        # "could not infer format" warnings for columns that turn out not to be dates
+        warnings.simplefilter("ignore", UserWarning)
+        return not pd.to_datetime(sample, errors="coerce").isna().any()
+
+
+def to_dates(s: pd.Series) -> pd.Series:
+    # the column as datetimes, unparseable values become NaT
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return pd.to_datetime(s, errors="coerce")
+
+
+def _parse_dates(s: pd.Series):
+    # the column as datetimes if every sampled value parses as a date, else None
+    if not looks_like_dates(s):
+        return None
+    parsed = to_dates(s)
+    if parsed.notna().sum() != s.notna().sum():
+        return None
+    return parsed
+
+
+def compact_column(s: pd.Series, parse_dates=True) -> pd.Series:
+    # smallest lossless dtype for one column
+    if pd.api.types.is_bool_dtype(s):
+        return s
+    if pd.api.types.is_integer_dtype(s):
+        return pd.to_numeric(s, downcast="integer")
+    if pd.api.types.is_float_dtype(s):
+        small = s.astype(np.float32)
+        # only downcast when every value survives the round trip
+        if np.array_equal(small.to_numpy(dtype=np.float64), s.to_numpy(dtype=np.float64), equal_nan=True):
+            return small
+        return s
+    if _is_text(s):
+        if parse_dates:
+            parsed = _parse_dates(s)
+            if parsed is not None:
+                return parsed
+        if len(s) and s.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(s):
+            return s.astype("category")
+    return s
+
+
+def compact_dtypes(df: pd.DataFrame, parse_dates=True):
+    # downcast numerics, turn low-cardinality text into categoricals and parse date columns.
+    # returns the compacted frame and a report of memory use before and after.
+    before = int(df.memory_usage(deep=True).sum())
+    columns = []
+    changed = {}
+    for i in range(df.shape[1]):
+        old = df.iloc[:, i]
+        new = compact_column(old, parse_dates=parse_dates)
+        if new.dtype != old.dtype:
+            changed[str(df.columns[i])] = (str(old.dtype), str(new.dtype))
+        columns.append(new)
+    compacted = pd.concat(columns, axis=1) if columns else df.copy()
+    compacted.columns = df.columns
+    after = int(compacted.memory_usage(deep=True).sum())
+    return compacted, {"before": before, "after": after, "changed": changed}
+
+
+def format_bytes(n) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
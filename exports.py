@@ -0,0 +1,113 @@
+import gzip
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+# download formats: file extension and mime type
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "CSV (gzip)": (".csv.gz", "application/gzip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+# finished exports are kept here and reused for the same data and format
+EXPORT_DIR = os.getenv("VIZION_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "vizion-exports"))
+EXPORT_TTL_SECONDS = float(os.getenv("VIZION_EXPORT_TTL", "86400"))
+# rows serialized at a time
+EXPORT_CHUNK_ROWS = int(os.getenv("VIZION_EXPORT_CHUNK_ROWS", "100000"))
+# level 1 compresses wide numeric csvs ~6x faster than level 6
+GZIP_LEVEL = int(os.getenv("VIZION_EXPORT_GZIP_LEVEL", "1"))
+
+
+def _chunks(df: pd.DataFrame, chunk_rows):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _write(df: pd.DataFrame, tmp: str, fmt: str, chunk_rows):
+    if fmt in ("CSV", "CSV (gzip)"):
+        if fmt == "CSV (gzip)":
+            f = gzip.open(tmp, "wb", compresslevel=GZIP_LEVEL)
+        else:
+            f = open(tmp, "wb")
+        with f:
+            if df.empty:
+                f.write(df.to_csv(index=False).encode("utf-8"))
+            # each chunk is encoded to one string and written at once; letting to_csv
+            # write row by row into the gzip stream is many times slower
+            for i, chunk in enumerate(_chunks(df, chunk_rows)):
+                f.write(chunk.to_csv(index=False, header=i == 0).encode("utf-8"))
+    elif fmt == "Parquet":
+        writer = None
+        try:
+            for chunk in _chunks(df, chunk_rows):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, table.schema)
+                writer.write_table(table.cast(writer.schema))
+            if writer is None:
+                pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+
+def write_export(df: pd.DataFrame, path: str, fmt: str, chunk_rows=EXPORT_CHUNK_ROWS):
+    # serialize df chunk by chunk into path, so only one chunk is encoded in memory at a time.
+    # written to a temporary name first so a half-written file is never served; the name is
+    # per process and thread so two sessions exporting the same data never share it.
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        _write(df, tmp, fmt, chunk_rows)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+def _prune_exports():
+    now = time.time()
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > EXPORT_TTL_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def export_file(df: pd.DataFrame, export_key: str, fmt: str) -> str:
+    # path of the export of df in fmt, written on first request and reused afterwards
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, export_key + EXPORT_FORMATS[fmt][0])
+    if not os.path.exists(path):
+        _prune_exports()
+        write_export(df, path, fmt)
+    return path
+
+
+def _read_export(df, export_key, fmt) -> bytes:
+    with open(export_file(df, export_key, fmt), "rb") as f:
+        return f.read()
+
+
+def export_panel(df: pd.DataFrame, export_key: str, file_stem: str, label: str, widget_key: str):
+    # format picker and download button. nothing is serialized until the button is clicked.
+    c1, c2 = st.columns([1, 2])
+    fmt = c1.selectbox("Format", list(EXPORT_FORMATS), key=f"{widget_key}_format", label_visibility="collapsed")
+    ext, mime = EXPORT_FORMATS[fmt]
+    c2.download_button(
+        label=label,
+        data=lambda: _read_export(df, export_key, fmt),
+        file_name=file_stem + ext,
+        mime=mime,
+        key=f"{widget_key}_download"
+    )
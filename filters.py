@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import perf
+from cache import BoundedCache
+from cube import category_keys, dimensions, measure_columns
+from timeseries import date_columns, parsed_dates
+
+# per-column indexes and row selections per dataset, shared by every session
+filter_cache = BoundedCache(int(os.getenv("VIZION_FILTER_CACHE_MB", "256")) * 1024 * 1024, name="filters")
+# filtered rows taken out of their dataset, per filtered hash. kept apart from the indexes
+# so a few large views cannot evict them, and bounded like the dataset cache.
+view_cache = BoundedCache(int(os.getenv("VIZION_VIEW_CACHE_MB", "1024")) * 1024 * 1024, name="views")
+
+
+def filter_columns(df: pd.DataFrame, content_hash: str) -> dict:
+    # filterable columns by kind: "category" for low-cardinality columns (the cube
+    # dimensions), "range" for numeric and date columns
+    kinds = {c: "range" for c in measure_columns(df)}
+    kinds.update({c: "date" for c in date_columns(df, content_hash)})
+    for c in dimensions(df, content_hash):
+        kinds.setdefault(c, "category")
+    return {c: kinds[c] for c in df.columns if c in kinds}
+
+
+def _range_values(df, content_hash, col) -> np.ndarray:
+    # the column as float64 or datetime64[ns] with missing values as nan / nat
+    s = df[col]
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return s.to_numpy(dtype=np.float64, na_value=np.nan)
+    if not pd.api.types.is_datetime64_any_dtype(s):
+        s = parsed_dates(df, content_hash, col)
+    elif getattr(s.dt, "tz", None) is not None:
+        s = s.dt.tz_localize(None)
+    return s.to_numpy(dtype="datetime64[ns]")
+
+
+def range_index(df: pd.DataFrame, content_hash: str, col) -> dict:
+    # the non-missing values of col in sorted order with the row position of each, so a
+    # range is two binary searches: {"values": sorted values, "positions": row positions}
+    def build():
+        with perf.span("range index", column=str(col)):
+            values = _range_values(df, content_hash, col)
+            missing = np.isnat(values) if values.dtype.kind == "M" else np.isnan(values)
+            positions = np.flatnonzero(~missing)
+            order = np.argsort(values[positions], kind="stable")
+            return {"values": values[positions][order], "positions": positions[order]}
+
+    return filter_cache.get_or_create(("range", content_hash, col), build)
+
+
+def category_index(df: pd.DataFrame, content_hash: str, col) -> dict:
+    # row positions grouped by value: the rows holding categories[i] are
+    # positions[offsets[i]:offsets[i + 1]], in row order
+    def build():
+        with perf.span("category index", column=str(col)):
+            keys = category_keys(df, [col])[col]
+            codes = keys.cat.codes.to_numpy()
+            positions = np.argsort(codes, kind="stable")
+            counts = np.bincount(codes[codes >= 0], minlength=len(keys.cat.categories))
+            # missing values (code -1) sort first and are never selected
+            offsets = np.concatenate([[0], np.cumsum(counts)]) + np.count_nonzero(codes < 0)
+            return {"categories": list(keys.cat.categories), "positions": positions, "offsets": offsets}
+
+    return filter_cache.get_or_create(("category", content_hash, col), build)
+
+
+def _rows(df, content_hash, spec) -> np.ndarray:
+    # sorted row positions matching one filter
+    col = spec["column"]
+    if "values" in spec:
+        index = category_index(df, content_hash, col)
+        lookup = {str(c): i for i, c in enumerate(index["categories"])}
+        chosen = [lookup[str(v)] for v in spec["values"] if str(v) in lookup]
+        offsets = index["offsets"]
+        parts = [index["positions"][offsets[i]:offsets[i + 1]] for i in chosen]
+        return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+    index = range_index(df, content_hash, col)
+    values = index["values"]
+    low, high = spec.get("min"), spec.get("max")
+    if values.dtype.kind == "M":
+        low = None if low is None else np.datetime64(pd.Timestamp(low), "ns")
+        # a date bound includes the whole last day
+        high = None if high is None else np.datetime64(pd.Timestamp(high) + pd.Timedelta(days=1), "ns")
+        start = 0 if low is None else np.searchsorted(values, low, "left")
+        stop = len(values) if high is None else np.searchsorted(values, high, "left")
+    else:
+        start = 0 if low is None else np.searchsorted(values, low, "left")
+        stop = len(values) if high is None else np.searchsorted(values, high, "right")
+    return np.sort(index["positions"][start:stop])
+
+
+def filtered_hash(content_hash: str, filters) -> str:
+    # content hash of the rows of a dataset that pass filters, for the downstream caches
+    text = json.dumps(filters, sort_keys=True, default=str)
+    return hashlib.sha256(f"{content_hash}\nfilter\n{text}".encode("utf-8")).hexdigest()
+
+
+def select_rows(df: pd.DataFrame, content_hash: str, filters) -> np.ndarray:
+    # sorted positions of the rows passing every filter, from the column indexes: each
+    # filter is an index lookup, and the lookups are intersected through a bitmap of the
+    # smallest selection instead of evaluating every filter on every row
+    def select():
+        with perf.span("select rows"):
+            selections = sorted((_rows(df, content_hash, spec) for spec in filters), key=len)
+            rows = selections[0]
+            for other in selections[1:]:
+                if not len(rows):
+                    break
+                bitmap = np.zeros(len(df), dtype=bool)
+                bitmap[other] = True
+                rows = rows[bitmap[rows]]
+            return rows
+
+    return filter_cache.get_or_create(("rows", filtered_hash(content_hash, filters)), select)
+
+
+def apply_filters(df: pd.DataFrame, content_hash: str, filters):
+    # (view of the rows passing filters, its content hash). without filters the frame is
+    # returned as is. a contiguous selection is a slice that shares the data; any other
+    # selection is taken once into the view cache, so reruns do not copy the rows again.
+    if not filters:
+        return df, content_hash
+    key = filtered_hash(content_hash, filters)
+    rows = select_rows(df, content_hash, filters)
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        return df.iloc[rows[0]:rows[-1] + 1], key
+    # handed out as a shallow copy, like load_shared
+    return view_cache.get_or_create(key, lambda: df.take(rows)).copy(deep=False), key
+
+
+def _restore(filters, kinds, key_prefix):
+    # put saved filters into the widgets once
+    cols_key = f"{key_prefix}_filter_columns"
+    if cols_key in st.session_state:
+        return
+    st.session_state[cols_key] = [f["column"] for f in filters if f.get("column") in kinds]
+    for f in filters:
+        col = f.get("column")
+        if col not in kinds:
+            continue
+        widget = f"{key_prefix}_filter_{col}"
+        if "values" in f:
+            st.session_state[widget] = list(f["values"])
+        elif kinds[col] == "date":
+            st.session_state[widget] = (pd.Timestamp(f["min"]).date(), pd.Timestamp(f["max"]).date())
+        else:
+            st.session_state[widget] = (f["min"], f["max"])
+
+
+def filter_panel(df: pd.DataFrame, content_hash: str, key_prefix="default", initial=None):
+    # widgets to restrict the analysis to some rows. returns (filtered view, its content
+    # hash, the filters as saved in the analysis config).
+    kinds = filter_columns(df, content_hash)
+    if not kinds:
+        return df, content_hash, []
+    if initial:
+        _restore(initial, kinds, key_prefix)
+
+    filters = []
+    with st.expander("Filter rows", expanded=bool(initial)):
+        cols_key = f"{key_prefix}_filter_columns"
+        if any(c not in kinds for c in st.session_state.get(cols_key, [])):
+            del st.session_state[cols_key]
+        chosen = st.multiselect("Filter by columns:", list(kinds), key=cols_key)
+        for col in chosen:
+            widget = f"{key_prefix}_filter_{col}"
+            if kinds[col] == "category":
+                categories = category_index(df, content_hash, col)["categories"]
+                options = [str(c) for c in categories]
+                if any(v not in options for v in st.session_state.get(widget, [])):
+                    del st.session_state[widget]
+                values = st.multiselect(f"{col} is one of:", options, key=widget)
+                if values:
+                    filters.append({"column": col, "values": values})
+                continue
+
+            values = range_index(df, content_hash, col)["values"]
+            if not len(values):
+                st.caption(f"{col} has no values to filter on.")
+                continue
+            if kinds[col] == "date":
+                first, last = pd.Timestamp(values[0]).date(), pd.Timestamp(values[-1]).date()
+            elif pd.api.types.is_integer_dtype(df[col]):
+                first, last = int(values[0]), int(values[-1])
+            else:
+                first, last = float(values[0]), float(values[-1])
+            if first == last:
+                st.caption(f"{col} only holds {first}.")
+                continue
+            # the whole range by default; a saved range may not fit this data
+            current = st.session_state.get(widget)
+            if current is None or not (first <= current[0] <= current[1] <= last):
+                st.session_state[widget] = (first, last)
+            low, high = st.slider(f"{col} between:", min_value=first, max_value=last, key=widget)
+            if (low, high) != (first, last):
+                if kinds[col] == "date":
+                    low, high = low.isoformat(), high.isoformat()
+                filters.append({"column": col, "min": low, "max": high})
+
+        view, view_hash = apply_filters(df, content_hash, filters)
+        if filters and view.empty:
+            # saved without the filters, like the rows shown
+            st.warning("No rows match these filters, showing all rows.")
+            return df, content_hash, []
+        if filters:
+            st.caption(f"Showing {len(view):,} of {len(df):,} rows.")
+    return view, view_hash, filters
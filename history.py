@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+
+from components.reports import REPORT_DIR, report_path
+from db import session_scope
+from jobs import check_cancelled, submit
+from models import AnalysisHistory, Dataset, DatasetVersion
+from storage import DATA_DIR, remove_dataset
+
+HISTORY_PAGE_SIZE = int(os.getenv("VIZION_HISTORY_PAGE_SIZE", "20"))
+# how often the orphan reconciliation job runs, at most
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("VIZION_RECONCILE_INTERVAL", "600"))
+# rows checked per reconciliation batch
+RECONCILE_BATCH = 500
+# stored files younger than this are never collected: they may belong to a save whose
+# dataset row is not committed yet
+STORAGE_GC_GRACE_SECONDS = float(os.getenv("VIZION_STORAGE_GC_GRACE", "300"))
+
+_last_reconcile = None
+_reconcile_lock = threading.Lock()
+
+
+def history_page(session, user_id, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    # one page of a user's analyses, newest first, with their datasets loaded in the same query.
+    # cursor is the (created_at, id) of the last row of the previous page.
+    # returns the rows and the cursor for the next page (None on the last page).
+    query = (
+        session.query(AnalysisHistory)
+        .options(joinedload(AnalysisHistory.dataset))
+        .filter(AnalysisHistory.user_id == user_id)
+    )
+    if cursor is not None:
+        created_at, analysis_id = cursor
+        query = query.filter(or_(
+            AnalysisHistory.created_at < created_at,
+            and_(AnalysisHistory.created_at == created_at, AnalysisHistory.id < analysis_id)
+        ))
+    rows = (
+        query.order_by(AnalysisHistory.created_at.desc(), AnalysisHistory.id.desc())
+        .limit(page_size + 1)
+        .all()
+    )
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, (rows[-1].created_at, rows[-1].id)
+    return rows, None
+
+
+def reconcile_orphans(job=None):
+    # delete analyses whose dataset row or stored file is gone.
+    # walks the table in keyset batches so memory stays flat for large histories.
+    removed = 0
+    with session_scope() as session:
+        last_id = None
+        while True:
+            query = (
+                session.query(AnalysisHistory.id, Dataset.storage_path)
+                .outerjoin(Dataset, AnalysisHistory.dataset_id == Dataset.id)
+                .order_by(AnalysisHistory.id)
+            )
+            if last_id is not None:
+                query = query.filter(AnalysisHistory.id > last_id)
+            batch = query.limit(RECONCILE_BATCH).all()
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            exists = {}
+            orphans = []
+            for analysis_id, storage_path in batch:
+                if storage_path is None:
+                    orphans.append(analysis_id)
+                    continue
+                if storage_path not in exists:
+                    exists[storage_path] = os.path.exists(storage_path)
+                if not exists[storage_path]:
+                    orphans.append(analysis_id)
+            if orphans:
+                session.query(AnalysisHistory).filter(
+                    AnalysisHistory.id.in_(orphans)
+                ).delete(synchronize_session=False)
+                session.commit()
+                removed += len(orphans)
+        return removed
+
+
+def _recently_used(path) -> bool:
+    try:
+        return time.time() - os.path.getmtime(path) < STORAGE_GC_GRACE_SECONDS
+    except OSError:
+        return False
+
+
+def release_storage(session, paths):
+    # reference-counted cleanup: delete the stored files among paths that no dataset
+    # refers to any more. call after committing the deletion of the datasets using them.
+    removed = 0
+    for path in set(paths):
+        still_used = (
+            session.query(Dataset.id).filter(Dataset.storage_path == path).first()
+            or session.query(DatasetVersion.id).filter(
+                or_(DatasetVersion.storage_path == path, DatasetVersion.state_path == path)
+            ).first()
+        )
+        if still_used is not None or _recently_used(path) or not os.path.exists(path):
+            continue
+        remove_dataset(path)
+        removed += 1
+    return removed
+
+
+def collect_reports():
+    # delete the report files no analysis records as its current report: reports of
+    # configs or data that changed since, and leftovers of failed builds
+    if not os.path.isdir(REPORT_DIR):
+        return 0
+    with session_scope() as session:
+        referenced = {
+            os.path.basename(report_path(key)) for (key,) in
+            session.query(AnalysisHistory.report_key).filter(AnalysisHistory.report_key.isnot(None)).distinct()
+        }
+    removed = 0
+    for name in os.listdir(REPORT_DIR):
+        path = os.path.join(REPORT_DIR, name)
+        # a report just built is recorded on its analysis right after it is written
+        if name in referenced or _recently_used(path):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+    return removed
+
+
+def collect_storage(job=None):
+    # delete every stored file no dataset refers to, such as the leftovers of a failed
+    # save or of files that were still in their grace period when released, and the
+    # reports no analysis refers to
+    removed = collect_reports()
+    if not os.path.isdir(DATA_DIR):
+        return removed
+    with session_scope() as session:
+        referenced = {os.path.abspath(p) for (p,) in session.query(Dataset.storage_path).distinct()}
+        for chunk, state in session.query(DatasetVersion.storage_path, DatasetVersion.state_path):
+            referenced.add(os.path.abspath(chunk))
+            if state:
+                referenced.add(os.path.abspath(state))
+    for name in os.listdir(DATA_DIR):
+        folder = os.path.join(DATA_DIR, name)
+        if not os.path.isdir(folder):
+            continue
+        for filename in os.listdir(folder):
+            path = os.path.join(folder, filename)
+            if os.path.abspath(path) in referenced or _recently_used(path):
+                continue
+            remove_dataset(path)
+            removed += 1
+        check_cancelled(job)
+    return removed
+
+
+def _maintenance(job=None):
+    return reconcile_orphans(job=job), collect_storage(job=job)
+
+
+def schedule_reconcile():
+    # start the reconciliation and storage collection job in the worker pool if it has
+    # not run recently
+    global _last_reconcile
+    with _reconcile_lock:
+        now = time.monotonic()
+        if _last_reconcile is not None and now - _last_reconcile < RECONCILE_INTERVAL_SECONDS:
+            return
+        _last_reconcile = now
+    submit(("reconcile", _last_reconcile), _maintenance, label="Reconciling history...")
+
+
+def saved_recipes(session, user_id, limit=50):
+    # cleaning recipes stored with the user's most recent analyses, by display label
+    rows = (
+        session.query(AnalysisHistory)
+        .options(joinedload(AnalysisHistory.dataset))
+        .filter(AnalysisHistory.user_id == user_id, AnalysisHistory.insights.isnot(None))
+        .order_by(AnalysisHistory.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+    recipes = {}
+    for a in rows:
+        try:
+            recipe = json.loads(a.insights).get("cleaning")
+        except (ValueError, AttributeError):
+            continue
+        if recipe:
+            filename = a.dataset.filename if a.dataset else "[Missing dataset]"
+            recipes[f"{filename} — {a.created_at.strftime('%Y-%m-%d %H:%M:%S')}"] = recipe
+    return recipes
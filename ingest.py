@@ -0,0 +1,301 @@
+import codecs
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from correlation import correlation_matrix
+
+# uploads bigger than this are profiled in streaming mode instead of loaded whole
+STREAMING_THRESHOLD_MB = float(os.getenv("VIZION_STREAMING_THRESHOLD_MB", "200"))
+# rows parsed per chunk in streaming mode
+CHUNK_ROWS = int(os.getenv("VIZION_CHUNK_ROWS", "200000"))
+# rows kept as a uniform random sample for charts and quantiles
+SAMPLE_ROWS = int(os.getenv("VIZION_SAMPLE_ROWS", "100000"))
+# distinct values tracked per text column for the top / freq columns
+TOP_VALUES = 1000
+# hyperloglog precision, 2**12 registers per column (~1.6% error)
+HLL_BITS = 12
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def detect_encoding(source, sample_bytes=1 << 20) -> str:
+    # guess the encoding of a csv from its first megabyte: utf-8 if it decodes, else latin-1
+    if hasattr(source, "read"):
+        _rewind(source)
+        sample = source.read(sample_bytes)
+        _rewind(source)
+    else:
+        with open(source, "rb") as f:
+            sample = f.read(sample_bytes)
+    try:
+        # incremental decoder so a multi-byte character cut off at the end is not an error
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def source_hash(source, block_bytes=1 << 20) -> str:
+    # sha256 of the raw bytes of a file or file-like object
+    h = hashlib.sha256()
+    if hasattr(source, "read"):
+        _rewind(source)
+        for block in iter(lambda: source.read(block_bytes), b""):
+            h.update(block)
+        _rewind(source)
+    else:
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(block_bytes), b""):
+                h.update(block)
+    return h.hexdigest()
+
+
+def should_stream(size_bytes) -> bool:
+    return size_bytes is not None and size_bytes > STREAMING_THRESHOLD_MB * 1024 * 1024
+
+
+def iter_csv_chunks(source, encoding=None, chunksize=CHUNK_ROWS):
+    # yield the csv as dataframes of at most chunksize rows
+    if encoding is None:
+        encoding = detect_encoding(source)
+    _rewind(source)
+    with pd.read_csv(source, encoding=encoding, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def _hll_add(registers, values: pd.Series):
+    if values.empty:
+        return
+    h = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    idx = (h >> np.uint64(64 - HLL_BITS)).astype(np.int64)
+    # rank = position of the first set bit in the next 32 bits
+    rest = ((h << np.uint64(HLL_BITS)) >> np.uint64(32)).astype(np.float64)
+    bit_length = np.zeros(len(rest))
+    nonzero = rest > 0
+    bit_length[nonzero] = np.floor(np.log2(rest[nonzero])) + 1
+    rank = (33 - bit_length).astype(np.uint8)
+    np.maximum.at(registers, idx, rank)
+
+
+def _hll_count(registers) -> int:
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        # linear counting is more accurate for small cardinalities
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def _epoch_ns(values: pd.Series) -> np.ndarray:
+    # datetimes as float nanoseconds since the epoch, utc for timezone-aware columns
+    if getattr(values.dt, "tz", None) is not None:
+        values = values.dt.tz_convert(None)
+    return values.to_numpy(dtype="datetime64[ns]").view(np.int64).astype(np.float64)
+
+
+class StreamingProfile:
+    # one-pass profile of a csv read in chunks. memory stays bounded by the
+    # number of columns, TOP_VALUES and SAMPLE_ROWS, never by the row count.
+
+    def __init__(self, sample_rows=SAMPLE_ROWS, seed=0):
+        self.sample_rows = sample_rows
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.columns = []
+        self.stats = {}
+        self.sample = None
+        self.sample_keys = None
+
+    def _new_column(self, numeric, tz=None, datetime=False):
+        # datetime columns keep moments and min / max of their epoch nanoseconds, like
+        # numbers; tz is the timezone they are shown in
+        return {
+            "numeric": numeric,
+            "datetime": datetime,
+            "tz": tz,
+            "count": 0,
+            "missing": 0,
+            "mean": 0.0,
+            "m2": 0.0,
+            "min": None,
+            "max": None,
+            "values": pd.Series(dtype="int64"),
+            "hll": np.zeros(1 << HLL_BITS, dtype=np.uint8),
+        }
+
+    def update(self, chunk: pd.DataFrame):
+        for col in chunk.columns:
+            s = chunk[col]
+            numeric = pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s)
+            dates = pd.api.types.is_datetime64_any_dtype(s)
+            col_stats = self.stats.get(col)
+            if col_stats is None:
+                self.columns.append(col)
+                tz = getattr(s.dt, "tz", None) if dates else None
+                col_stats = self.stats[col] = self._new_column(numeric, None if tz is None else str(tz), dates)
+                # the column was absent from earlier chunks
+                col_stats["missing"] = self.rows
+            elif col_stats["numeric"] and not numeric and s.notna().any():
+                # a later chunk holds text in a column that looked numeric
+                col_stats["numeric"] = False
+            elif col_stats.get("datetime") and not dates and s.notna().any():
+                col_stats["datetime"] = False
+
+            valid = s.dropna()
+            col_stats["missing"] += len(s) - len(valid)
+            _hll_add(col_stats["hll"], valid if numeric or dates else valid.astype(str))
+
+            if col_stats["numeric"] and numeric:
+                self._update_moments(col_stats, valid.to_numpy(dtype=np.float64))
+            elif col_stats.get("datetime") and dates:
+                self._update_moments(col_stats, _epoch_ns(valid))
+            else:
+                col_stats["count"] += len(valid)
+                counts = col_stats["values"].add(valid.astype(str).value_counts(), fill_value=0)
+                col_stats["values"] = counts.nlargest(TOP_VALUES)
+
+        for col in self.columns:
+            if col not in chunk.columns:
+                self.stats[col]["missing"] += len(chunk)
+
+        self._update_sample(chunk)
+        self.rows += len(chunk)
+
+    def _update_moments(self, col_stats, values):
+        n_b = len(values)
+        if n_b == 0:
+            return
+        mean_b = values.mean()
+        m2_b = ((values - mean_b) ** 2).sum()
+        n_a = col_stats["count"]
+        n = n_a + n_b
+        delta = mean_b - col_stats["mean"]
+        # chan et al. parallel update of count, mean and sum of squared deviations
+        col_stats["mean"] += delta * n_b / n
+        col_stats["m2"] += m2_b + delta * delta * n_a * n_b / n
+        col_stats["count"] = n
+        lo, hi = values.min(), values.max()
+        col_stats["min"] = lo if col_stats["min"] is None else min(col_stats["min"], lo)
+        col_stats["max"] = hi if col_stats["max"] is None else max(col_stats["max"], hi)
+
+    def _update_sample(self, chunk):
+        # keep the rows with the smallest random keys: a uniform sample of everything seen
+        keys = self.rng.random(len(chunk))
+        if self.sample is not None:
+            chunk = pd.concat([self.sample, chunk], ignore_index=True)
+            keys = np.concatenate([self.sample_keys, keys])
+        if len(chunk) > self.sample_rows:
+            keep = np.argpartition(keys, self.sample_rows)[:self.sample_rows]
+            keep.sort()
+            chunk = chunk.iloc[keep].reset_index(drop=True)
+            keys = keys[keep]
+        self.sample = chunk
+        self.sample_keys = keys
+
+    def summary(self) -> pd.DataFrame:
+        # same layout as df.describe(include="all").T
+        rows = {}
+        for col in self.columns:
+            col_stats = self.stats[col]
+            if col_stats["numeric"]:
+                n = col_stats["count"]
+                quartiles = [np.nan] * 3
+                if self.sample is not None and col in self.sample:
+                    values = pd.to_numeric(self.sample[col], errors="coerce").dropna()
+                    if not values.empty:
+                        quartiles = list(values.quantile([0.25, 0.5, 0.75]))
+                rows[col] = {
+                    "count": n,
+                    "mean": col_stats["mean"] if n else np.nan,
+                    "std": np.sqrt(col_stats["m2"] / (n - 1)) if n > 1 else np.nan,
+                    "min": col_stats["min"],
+                    "25%": quartiles[0],
+                    "50%": quartiles[1],
+                    "75%": quartiles[2],
+                    "max": col_stats["max"],
+                }
+            elif col_stats.get("datetime"):
+                rows[col] = self._date_summary(col, col_stats)
+            else:
+                values = col_stats["values"]
+                rows[col] = {
+                    "count": col_stats["count"],
+                    "unique": _hll_count(col_stats["hll"]),
+                    "top": values.idxmax() if not values.empty else np.nan,
+                    "freq": values.max() if not values.empty else np.nan,
+                }
+        columns = ["count", "unique", "top", "freq", "mean", "std", "min", "25%", "50%", "75%", "max"]
+        summary = pd.DataFrame.from_dict(rows, orient="index")
+        return summary.reindex(columns=[c for c in columns if c in summary.columns])
+
+    def _date_summary(self, col, col_stats) -> dict:
+        # like describe() of a datetime column: no std, quartiles from the row sample
+        def timestamp(ns):
+            if ns is None or pd.isna(ns):
+                return pd.NaT
+            value = pd.Timestamp(int(ns))
+            tz = col_stats.get("tz")
+            return value if tz is None else value.tz_localize("UTC").tz_convert(tz)
+
+        n = col_stats["count"]
+        quartiles = [pd.NaT] * 3
+        if self.sample is not None and col in self.sample:
+            values = self.sample[col]
+            if pd.api.types.is_datetime64_any_dtype(values) and values.notna().any():
+                quartiles = list(values.dropna().quantile([0.25, 0.5, 0.75]))
+        return {
+            "count": n,
+            # the float mean of nanoseconds is not exact below a microsecond
+            "mean": timestamp(col_stats["mean"]).round("us") if n else pd.NaT,
+            "min": timestamp(col_stats["min"]),
+            "25%": quartiles[0],
+            "50%": quartiles[1],
+            "75%": quartiles[2],
+            "max": timestamp(col_stats["max"]),
+            "std": np.nan,
+        }
+
+    def missing(self) -> pd.DataFrame:
+        missing = pd.DataFrame({
+            "Column": self.columns,
+            "Missing Count": [self.stats[c]["missing"] for c in self.columns],
+        })
+        return missing
+
+    def profile(self) -> dict:
+        # same shape as profiler.compute_profile; correlation is estimated from the row sample
+        correlation = None
+        if self.sample is not None:
+            numeric_cols = [c for c in self.columns if self.stats[c]["numeric"]]
+            numeric = self.sample[numeric_cols].apply(pd.to_numeric, errors="coerce")
+            correlation = correlation_matrix(numeric)
+        return {
+            "summary": self.summary(),
+            "missing": self.missing(),
+            "correlation": correlation,
+        }
+
+
+def profiled(chunks, profile: StreamingProfile):
+    # pass chunks through while feeding them to profile, so a single read of a file can
+    # both store and profile it
+    for chunk in chunks:
+        profile.update(chunk)
+        yield chunk
+
+
+def stream_profile(source, encoding=None, chunksize=CHUNK_ROWS):
+    # profile a csv chunk by chunk, returns the StreamingProfile with its row sample
+    profile = StreamingProfile()
+    for chunk in iter_csv_chunks(source, encoding=encoding, chunksize=chunksize):
+        profile.update(chunk)
+    return profile
@@ -0,0 +1,191 @@
+import contextvars
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import streamlit as st
+
+# worker threads shared by every session of the process. threads rather than processes
+# so large frames are not pickled; pandas and numpy release the gil in their heavy loops.
+MAX_WORKERS = int(os.getenv("VIZION_WORKERS", str(os.cpu_count() or 4)))
+# slow batch work such as report builds runs in its own small pool so it never queues
+# ahead of the jobs interactive pages are waiting for
+POOL_WORKERS = {
+    "default": MAX_WORKERS,
+    "reports": int(os.getenv("VIZION_REPORT_WORKERS", "2")),
+}
+# pools run in worker processes instead: batch work whose arguments are small (paths,
+# hashes, configs) loads its own data there, so it neither holds the gil of the page
+# server nor evicts the frames its caches keep for interactive pages. functions must be
+# importable top-level functions; they get job=None, so report no progress and only
+# stop on cancel while still queued.
+PROCESS_POOLS = {"reports"}
+# a finished job is dropped as soon as its result is handed to the reruns waiting for it;
+# results nobody was waiting for (e.g. after an interrupted rerun) are kept this long so
+# the next rerun can pick them up
+RESULT_TTL_SECONDS = float(os.getenv("VIZION_JOB_RESULT_TTL", "300"))
+POLL_SECONDS = 0.1
+
+_executors = {}
+_jobs = {}
+# key -> number of reruns (of any session) currently waiting for the job
+_waiters = {}
+_lock = threading.Lock()
+
+
+class Job:
+    # handle passed to background functions as job=...: report progress, check for cancellation
+
+    def __init__(self, label):
+        self.label = label
+        self.progress = 0.0
+        self.message = label
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    def report(self, progress, message=None):
+        self.progress = min(max(float(progress), 0.0), 1.0)
+        if message:
+            self.message = message
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def check_cancelled(job):
+    # call between stages of a background function to stop early after a cancel
+    if job is not None and job.cancelled:
+        raise JobCancelled(job.label)
+
+
+def _get_executor(pool="default"):
+    executor = _executors.get(pool)
+    if executor is None:
+        if pool in PROCESS_POOLS:
+            # spawned, not forked: forking a process with running threads can copy held locks
+            executor = ProcessPoolExecutor(
+                max_workers=POOL_WORKERS[pool], mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=POOL_WORKERS[pool], thread_name_prefix=f"vizion-{pool}")
+        _executors[pool] = executor
+    return executor
+
+
+def _prune():
+    now = time.monotonic()
+    for key, (future, job) in list(_jobs.items()):
+        if job.finished_at is not None and now - job.finished_at > RESULT_TTL_SECONDS:
+            del _jobs[key]
+
+
+def submit(key, fn, *args, label="Working...", pool="default"):
+    # start fn(*args, job=job) in the pool, or return the job already running under key.
+    # in a process pool fn and args are pickled and fn gets job=None.
+    with _lock:
+        _prune()
+        entry = _jobs.get(key)
+        if entry is not None:
+            future, job = entry
+            if not (future.cancelled() or job.cancelled):
+                return entry
+
+        job = Job(label)
+
+        if pool in PROCESS_POOLS:
+            future = _get_executor(pool).submit(fn, *args, job=None)
+            future.add_done_callback(lambda _: setattr(job, "finished_at", time.monotonic()))
+        else:
+            def run():
+                try:
+                    return fn(*args, job=job)
+                finally:
+                    job.finished_at = time.monotonic()
+
+            # run in a copy of the caller's context so perf spans reach the submitting rerun
+            future = _get_executor(pool).submit(contextvars.copy_context().run, run)
+        _jobs[key] = (future, job)
+        return future, job
+
+
+def lookup(key):
+    # (future, job) submitted under key, or None. finished jobs are kept for RESULT_TTL_SECONDS.
+    with _lock:
+        return _jobs.get(key)
+
+
+def cancel(key):
+    with _lock:
+        entry = _jobs.pop(key, None)
+    if entry is not None:
+        future, job = entry
+        job.cancel()
+        future.cancel()
+
+
+def _cancel_unwaited(key):
+    # cancel the job under key unless a rerun is still waiting for it (jobs are shared by
+    # every session asking for the same key)
+    with _lock:
+        if _waiters.get(key):
+            return
+        entry = _jobs.pop(key, None)
+    if entry is not None:
+        future, job = entry
+        job.cancel()
+        future.cancel()
+
+
+def _stop_waiting(key, future):
+    # the last waiter to leave takes a finished job out of the registry, so its result
+    # (often a whole frame, already kept by the caller's own cache) is not pinned here
+    with _lock:
+        remaining = _waiters.pop(key, 1) - 1
+        if remaining:
+            _waiters[key] = remaining
+            return
+        entry = _jobs.get(key)
+        if future is not None and future.done() and entry is not None and entry[0] is future:
+            del _jobs[key]
+
+
+def run_in_background(slot, key, fn, *args, label="Working..."):
+    # run fn off the script thread and wait for it with a progress bar.
+    # slot names the place on the page the job belongs to: if this session's slot held a
+    # different job on the previous rerun, that job is cancelled unless another rerun is
+    # waiting for it. an interrupted rerun leaves the job running and the next rerun picks
+    # it up by key instead of restarting.
+    slots = st.session_state.setdefault("_job_slots", {})
+    previous = slots.get(slot)
+    if previous is not None and previous != key:
+        _cancel_unwaited(previous)
+    slots[slot] = key
+
+    with _lock:
+        _waiters[key] = _waiters.get(key, 0) + 1
+    future = None
+    try:
+        while True:
+            future, job = submit(key, fn, *args, label=label)
+            if not future.done():
+                bar = st.progress(job.progress, text=job.message)
+                while not future.done():
+                    time.sleep(POLL_SECONDS)
+                    bar.progress(job.progress, text=job.message)
+                bar.empty()
+            # another session may have cancelled a job this one was also waiting for
+            if future.cancelled() or isinstance(future.exception(), JobCancelled):
+                continue
+            return future.result()
+    finally:
+        _stop_waiting(key, future)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
 
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -28,9 +28,11 @@ class Dataset(Base):
 
     # Columns
     id = Column(String, primary_key=True)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
     filename = Column(String, nullable=False) 
-    storage_path = Column(String, nullable=False)
+    # datasets with identical content share one stored file (see storage.py)
+    storage_path = Column(String, nullable=False, index=True)
+    content_hash = Column(String, nullable=True, index=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     row_count= Column(Integer)
     column_count= Column(Integer)
@@ -39,12 +41,20 @@ class Dataset(Base):
 
     # Relationships
     owner = relationship("User", back_populates="datasets")
+    versions = relationship(
+        "DatasetVersion", back_populates="dataset", cascade="all, delete-orphan",
+        order_by="DatasetVersion.version"
+    )
 
 
 class AnalysisHistory(Base):
     # Stores analysis results for each dataset
     # Links to the Dataset table through dataset_id.
     __tablename__="analysis_history"
+    # history is always listed per user, newest first
+    __table_args__ = (
+        Index("ix_analysis_history_user_created", "user_id", "created_at"),
+    )
 
     id=Column(String, primary_key=True)
     dataset_id = Column(String, ForeignKey("datasets.id"))
@@ -52,7 +62,40 @@ class AnalysisHistory(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     summary = Column(Text, nullable=True)  # JSON or text summary of analysis results
     insights = Column(Text, nullable=True)  # JSON or text insights derived from analysis
+    report_key = Column(String, nullable=True)  # report_key of the last html report built for it
 
     # Relationships
     dataset = relationship("Dataset", back_populates="analyses")
-    user = relationship("User", back_populates="analyses")
\ No newline at end of file
+    user = relationship("User", back_populates="analyses")
+
+class DatasetVersion(Base):
+    # Rows appended to a saved dataset.
+    # The data of a dataset is its own stored file followed by the rows of every version in order;
+    # content_hash identifies the data up to and including this version.
+    __tablename__ = "dataset_versions"
+    __table_args__ = (
+        Index("ix_dataset_versions_dataset_version", "dataset_id", "version", unique=True),
+    )
+
+    id = Column(String, primary_key=True)
+    dataset_id = Column(String, ForeignKey("datasets.id"), nullable=False)
+    version = Column(Integer, nullable=False)  # 1 for the first append
+    storage_path = Column(String, nullable=False, index=True)  # only the appended rows
+    state_path = Column(String, nullable=True, index=True)  # mergeable statistics (see versions.py)
+    content_hash = Column(String, nullable=False)
+    row_count = Column(Integer)  # rows appended by this version
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    dataset = relationship("Dataset", back_populates="versions")
+
+
+class DatasetProfile(Base):
+    # Cached summary statistics for a dataset.
+    # Keyed by a hash of the data so identical content is only profiled once.
+    __tablename__ = "dataset_profiles"
+
+    content_hash = Column(String, primary_key=True)
+    summary = Column(Text, nullable=False)  # describe() output as JSON
+    missing = Column(Text, nullable=False)  # missing counts per column as JSON
+    correlation = Column(Text, nullable=True)  # numeric correlation matrix as JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,172 @@
+import contextvars
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+import streamlit as st
+
+from cache import caches
+
+# timing spans around the stages of a rerun, database query timings and an optional
+# sidebar breakdown. spans and slow queries are logged to the "vizion.perf" logger;
+# VIZION_PERF_LOG=stderr or VIZION_PERF_LOG=<file> writes them as json lines.
+PERF_LOG = os.getenv("VIZION_PERF_LOG", "")
+# queries slower than this are logged as warnings
+SLOW_QUERY_MS = float(os.getenv("VIZION_SLOW_QUERY_MS", "100"))
+# longest statement text put in a log record
+MAX_STATEMENT_CHARS = 500
+
+logger = logging.getLogger("vizion.perf")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "msg": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", {}))
+        return json.dumps(data, default=str)
+
+
+def _configure_logging():
+    if not PERF_LOG or logger.handlers:
+        return
+    handler = logging.StreamHandler() if PERF_LOG == "stderr" else logging.FileHandler(PERF_LOG)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+_configure_logging()
+
+
+class Run:
+    # timings collected during one script run
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []  # (start offset, depth, name, seconds)
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+# the run of the current script thread. background jobs get a copy of the context when
+# they are submitted (see jobs.submit), so their spans and queries count towards it too.
+_run = contextvars.ContextVar("vizion_perf_run", default=None)
+_depth = contextvars.ContextVar("vizion_perf_depth", default=0)
+
+
+def start_run(name="rerun"):
+    run = Run(name)
+    _run.set(run)
+    _depth.set(0)
+    return run
+
+
+def current_run():
+    return _run.get()
+
+
+def finish_run():
+    # log the totals of the current run
+    run = _run.get()
+    if run is None:
+        return
+    seconds = time.perf_counter() - run.started
+    logger.info(
+        f"{run.name} took {seconds * 1000:.1f} ms",
+        extra={"fields": {
+            "event": "run", "run": run.id, "name": run.name, "ms": round(seconds * 1000, 2),
+            "queries": run.queries, "query_ms": round(run.query_seconds * 1000, 2),
+        }}
+    )
+
+
+@contextmanager
+def span(name, **fields):
+    # time the block and record it on the current run. extra fields go into the log record.
+    run = _run.get()
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _depth.reset(token)
+        if run is not None:
+            run.spans.append((start - run.started, depth, name, seconds))
+        logger.info(
+            f"{name} took {seconds * 1000:.1f} ms",
+            extra={"fields": dict(
+                fields, event="span", span=name, ms=round(seconds * 1000, 2),
+                run=run.id if run else None
+            )}
+        )
+
+
+def record_query(statement, seconds):
+    # called by the engine events in db.py after every statement
+    run = _run.get()
+    if run is not None:
+        run.queries += 1
+        run.query_seconds += seconds
+    ms = seconds * 1000
+    if ms >= SLOW_QUERY_MS:
+        statement = " ".join(statement.split())[:MAX_STATEMENT_CHARS]
+        logger.warning(
+            f"slow query ({ms:.1f} ms): {statement}",
+            extra={"fields": {
+                "event": "slow_query", "ms": round(ms, 2), "statement": statement,
+                "run": run.id if run else None
+            }}
+        )
+
+
+def perf_panel():
+    # sidebar breakdown of the spans of the current run, behind a checkbox
+    run = _run.get()
+    if run is None:
+        return
+    st.sidebar.markdown("---")
+    if not st.sidebar.checkbox("Show performance", key="perf_panel"):
+        return
+    rows = [
+        {"Stage": " " * depth + name, "ms": round(seconds * 1000, 1)}
+        for _, depth, name, seconds in sorted(run.spans, key=lambda s: s[0])
+    ]
+    if rows:
+        st.sidebar.dataframe(pd.DataFrame(rows), hide_index=True)
+    total = time.perf_counter() - run.started
+    st.sidebar.caption(
+        f"This rerun: {total * 1000:.0f} ms so far, "
+        f"{run.queries} queries in {run.query_seconds * 1000:.0f} ms"
+    )
+    # process-wide caches, shared by every session since the server started
+    rows = []
+    for name, cache in sorted(caches.items()):
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        rows.append({
+            "Cache": name,
+            "Entries": stats["entries"],
+            "MB": round(stats["bytes"] / 1024 / 1024, 1),
+            "Budget MB": round(stats["max_bytes"] / 1024 / 1024),
+            "Hit rate": f"{stats['hits'] / lookups:.0%}" if lookups else "-",
+            "Hits": stats["hits"],
+            "Misses": stats["misses"],
+            "Evictions": stats["evictions"],
+        })
+    if rows:
+        st.sidebar.markdown("**Shared caches**")
+        st.sidebar.dataframe(pd.DataFrame(rows), hide_index=True)
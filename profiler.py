@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from io import StringIO
+
+import pandas as pd
+
+import perf
+from cache import BoundedCache
+from correlation import correlation_matrix
+from dedupe import fingerprint_cache
+from db import session_scope
+from jobs import check_cancelled
+from models import DatasetProfile
+
+# profiles already loaded or computed by this process, shared by every session
+profile_cache = BoundedCache(int(os.getenv("VIZION_PROFILE_CACHE_MB", "64")) * 1024 * 1024, name="profiles")
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    # hash of the column names, dtypes and row values of a frame
+    h = hashlib.sha256()
+    h.update(json.dumps([[str(c), str(t)] for c, t in df.dtypes.items()]).encode("utf-8"))
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    h.update(rows.tobytes())
+    content_hash = h.hexdigest()
+    # the row hashes double as the fingerprints for duplicate detection
+    fingerprint_cache.put((content_hash, None), rows)
+    return content_hash
+
+
+def compute_profile(df: pd.DataFrame, job=None) -> dict:
+    # summary statistics, missing counts and correlation matrix of a frame
+    if job is not None:
+        job.report(0.0, "Computing summary statistics...")
+    with perf.span("describe"):
+        summary = df.describe(include="all").T
+    check_cancelled(job)
+
+    if job is not None:
+        job.report(0.6, "Counting missing values...")
+    with perf.span("missing counts"):
+        missing = df.isnull().sum().reset_index()
+    missing.columns = ['Column', 'Missing Count']
+    check_cancelled(job)
+
+    if job is not None:
+        job.report(0.7, "Computing correlations...")
+    with perf.span("correlation"):
+        correlation = correlation_matrix(df, job=job, progress=(0.7, 1.0))
+
+    return {
+        "summary": summary,
+        "missing": missing,
+        "correlation": correlation,
+    }
+
+
+def _to_json(frame):
+    if frame is None:
+        return None
+    return frame.to_json(orient="split", date_format="iso", default_handler=str)
+
+
+def _from_json(text):
+    if text is None:
+        return None
+    return pd.read_json(StringIO(text), orient="split", convert_dates=False)
+
+
+def load_profile(content_hash: str):
+    # stored profile for this content, or None
+    with session_scope() as session:
+        row = session.get(DatasetProfile, content_hash)
+        if row is None:
+            return None
+        return {
+            "summary": _from_json(row.summary),
+            "missing": _from_json(row.missing),
+            "correlation": _from_json(row.correlation),
+        }
+
+
+def store_profile(content_hash: str, profile: dict):
+    with session_scope() as session:
+        session.merge(DatasetProfile(
+            content_hash=content_hash,
+            summary=_to_json(profile["summary"]),
+            missing=_to_json(profile["missing"]),
+            correlation=_to_json(profile["correlation"]),
+            created_at=datetime.utcnow()
+        ))
+        session.commit()
+
+
+def get_profile(df: pd.DataFrame, content_hash=None, job=None, persist=True) -> dict:
+    # profile of df, computed once per content and reused across reruns and sessions.
+    # persist=False keeps it in memory only, for frames that are not stored datasets.
+    if content_hash is None:
+        content_hash = frame_hash(df)
+
+    def load_or_compute():
+        profile = load_profile(content_hash) if persist else None
+        if profile is None:
+            profile = compute_profile(df, job=job)
+            if persist:
+                store_profile(content_hash, profile)
+        return profile
+
+    return profile_cache.get_or_create(content_hash, load_or_compute)
+
+
+def get_view_profile(df: pd.DataFrame, content_hash, job=None) -> dict:
+    # get_profile of a filtered view: every filter setting has its own hash, so these
+    # stay out of the dataset_profiles table
+    return get_profile(df, content_hash, job=job, persist=False)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+import perf
+from cache import BoundedCache
+from dedupe import drop_duplicates
+from jobs import check_cancelled
+
+# a cleaning recipe is an ordered list of steps, each a json-friendly dict:
+#   {"op": "missing", "strategy": "drop_rows" | "drop_columns" | "fill_mean" | "fill_median" | "fill_mode"}
+#   {"op": "drop_duplicates", "subset": [key columns]}   (subset is optional, default all columns)
+# recipes are stored with saved analyses and can be replayed against new uploads.
+
+MISSING_STRATEGIES = ("drop_rows", "drop_columns", "fill_mean", "fill_median", "fill_mode")
+
+# cleaned frames per (dataset hash, recipe), shared by every session
+recipe_cache = BoundedCache(int(os.getenv("VIZION_RECIPE_CACHE_MB", "256")) * 1024 * 1024, name="cleaned frames")
+
+
+def recipe_key(recipe) -> str:
+    return json.dumps(recipe, sort_keys=True)
+
+
+def derived_hash(content_hash: str, recipe) -> str:
+    # content hash of the cleaned frame, known without cleaning or hashing it
+    return hashlib.sha256(f"{content_hash}:{recipe_key(recipe)}".encode("utf-8")).hexdigest()
+
+
+def is_noop(recipe, total_missing=None, duplicates=None) -> bool:
+    # true when the recipe cannot change the data. missing-value steps are no-ops on a
+    # frame without missing values, duplicate removal on one without duplicates;
+    # None means that count is unknown.
+    for step in recipe:
+        if step["op"] == "missing" and total_missing == 0:
+            continue
+        if step["op"] == "drop_duplicates" and duplicates == 0:
+            continue
+        return False
+    return True
+
+
+def apply_step(df: pd.DataFrame, step, content_hash=None):
+    # apply one step, returns the new frame and a short description of what changed.
+    # content_hash identifies df and lets steps reuse cached work such as row fingerprints.
+    op = step["op"]
+    if op == "missing":
+        strategy = step["strategy"]
+        if strategy == "drop_rows":
+            out = df.dropna()
+            return out, {"rows_removed": len(df) - len(out)}
+        if strategy == "drop_columns":
+            out = df.dropna(axis=1)
+            return out, {"columns_removed": df.shape[1] - out.shape[1]}
+        if strategy == "fill_mean":
+            values = df.mean(numeric_only=True)
+        elif strategy == "fill_median":
+            values = df.median(numeric_only=True)
+        elif strategy == "fill_mode":
+            values = df.mode().iloc[0]
+        else:
+            raise ValueError(f"Unknown missing value strategy: {strategy}")
+        missing_before = int(df.isna().sum().sum())
+        if missing_before == 0:
+            return df, {"cells_filled": 0}
+        out = df.fillna(values)
+        return out, {"cells_filled": missing_before - int(out.isna().sum().sum())}
+    if op == "drop_duplicates":
+        out = drop_duplicates(df, content_hash, step.get("subset"))
+        return out, {"rows_removed": len(df) - len(out)}
+    raise ValueError(f"Unknown cleaning step: {op}")
+
+
+def _changed(reports) -> bool:
+    return any(any(v for v in report.values()) for report in reports)
+
+
+def apply_recipe(df: pd.DataFrame, recipe, job=None, content_hash=None):
+    # run every step in order. returns the cleaned frame, the per-step reports and
+    # whether anything changed, which is read off the reports instead of comparing frames.
+    reports = []
+    for i, step in enumerate(recipe):
+        if job is not None:
+            job.report(i / max(len(recipe), 1), f"Cleaning: {step['op'].replace('_', ' ')}...")
+        # the frame entering step i is the result of the first i steps
+        step_hash = content_hash if i == 0 or content_hash is None else derived_hash(content_hash, recipe[:i])
+        with perf.span(f"clean: {step['op']}"):
+            df, report = apply_step(df, step, step_hash)
+        reports.append(report)
+        check_cancelled(job)
+    return df, reports, _changed(reports)
+
+
+def cached_apply_recipe(df: pd.DataFrame, content_hash: str, recipe, job=None):
+    # apply_recipe memoized per (dataset, recipe). when the result of the first steps is
+    # already cached (e.g. computed to count duplicates), only the remaining steps run.
+    def apply():
+        for i in range(len(recipe) - 1, 0, -1):
+            prefix = recipe_cache.get((content_hash, recipe_key(recipe[:i])))
+            if prefix is not None:
+                prefix_df, prefix_reports, _ = prefix
+                out, reports, _ = apply_recipe(
+                    prefix_df, recipe[i:], job=job, content_hash=derived_hash(content_hash, recipe[:i])
+                )
+                reports = prefix_reports + reports
+                return out, reports, _changed(reports)
+        return apply_recipe(df, recipe, job=job, content_hash=content_hash)
+
+    return recipe_cache.get_or_create((content_hash, recipe_key(recipe)), apply)
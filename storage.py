@@ -0,0 +1,236 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from cache import BoundedCache
+
+# root folder for saved datasets, one folder per content key
+DATA_DIR = os.getenv("VIZION_DATA_DIR", "data")
+# arrow ipc (feather v2) file written for every saved dataset
+DATASET_FILE = "data.arrow"
+
+# loaded datasets shared by every session of the process, keyed by storage path. paths are
+# content addressed, so a path always holds the same data. load_shared hands out a shallow
+# copy of the cached frame: with copy-on-write (see enable_copy_on_write), adding,
+# replacing or changing columns on it copies the touched data and leaves the cached frame
+# as it was.
+dataset_cache = BoundedCache(int(os.getenv("VIZION_DATASET_CACHE_MB", "1024")) * 1024 * 1024, name="datasets")
+
+
+def enable_copy_on_write():
+    # copy-on-write is always on from pandas 3; older versions need it switched on so frames
+    # derived from a shared dataset copy their data before writing instead of changing it.
+    # process-wide, so the app calls it at startup rather than on import.
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
+
+
+def dataset_path(key: str) -> str:
+    return os.path.join(DATA_DIR, key, DATASET_FILE)
+
+
+def _reuse(path) -> bool:
+    # true when the content is already stored. the file is touched so garbage collection
+    # treats it as recently used while the new reference is being committed.
+    if not os.path.exists(path):
+        return False
+    os.utime(path)
+    return True
+
+
+def save_dataset(df: pd.DataFrame, key: str) -> str:
+    # write the frame as an uncompressed arrow ipc file and return its path.
+    # uncompressed so the file can be memory-mapped instead of decoded on load.
+    # key is the content hash of the frame: identical data is stored once and shared.
+    path = dataset_path(key)
+    if _reuse(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    feather.write_feather(table, tmp, compression="uncompressed")
+    os.replace(tmp, path)
+    return path
+
+
+def load_dataset(path: str, columns=None) -> pd.DataFrame:
+    # load a saved dataset, optionally only some of its columns
+    if path.endswith(".csv"):
+        # datasets saved before the columnar format was introduced
+        return pd.read_csv(path, usecols=columns)
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def load_parts(paths) -> pd.DataFrame:
+    # the stored files of a dataset and its appended versions as one frame
+    return _concat([load_dataset(p) for p in paths])
+
+
+def _concat(parts) -> pd.DataFrame:
+    if len(parts) == 1:
+        return parts[0]
+    df = pd.concat(parts, ignore_index=True)
+    # appended rows are stored as parsed; categories of the original file are kept
+    for c in df.columns:
+        if isinstance(parts[0][c].dtype, pd.CategoricalDtype) and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    return df
+
+
+def load_shared(paths) -> pd.DataFrame:
+    # load_dataset through the process-wide cache; sessions opening the same dataset at
+    # the same time wait for a single read. paths is one path or the list of files of a
+    # dataset with appended versions.
+    if isinstance(paths, str):
+        df = dataset_cache.get_or_create(paths, lambda: load_dataset(paths))
+    else:
+        paths = tuple(paths)
+        df = dataset_cache.get_or_create(paths[0] if len(paths) == 1 else paths, lambda: load_parts(paths))
+    return df.copy(deep=False)
+
+
+def stored_bytes(paths) -> int:
+    # size on disk of the stored files of a dataset
+    return sum(os.path.getsize(p) for p in paths)
+
+
+def _batches(path, chunk_rows=100_000):
+    # the rows of a stored file a bounded batch at a time, without loading the whole file
+    if path.endswith(".csv"):
+        with pd.read_csv(path, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                yield pa.RecordBatch.from_pandas(chunk, preserve_index=False)
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def load_sample(paths, rows: int, seed=0) -> pd.DataFrame:
+    # a uniform random sample of at most rows rows of the stored files, in row order, for
+    # datasets too large to load. every row gets a random key and the rows with the
+    # smallest keys are kept, so memory is bounded by one record batch plus the sample.
+    rng = np.random.default_rng(seed)
+    kept = []  # (keys, table) of the rows sampled so far
+    for path in paths:
+        for batch in _batches(path):
+            kept.append((rng.random(batch.num_rows), pa.Table.from_batches([batch])))
+            if sum(len(k) for k, _ in kept) > rows:
+                limit = np.partition(np.concatenate([k for k, _ in kept]), rows - 1)[rows - 1]
+                kept = [(k[k <= limit], t.filter(pa.array(k <= limit))) for k, t in kept]
+                kept = [(k, t) for k, t in kept if len(k)]
+    if not kept:
+        return load_dataset(paths[0]).head(0)
+    return _concat([t.to_pandas() for _, t in kept])
+
+
+def load_shared_sample(paths, rows: int) -> pd.DataFrame:
+    # load_sample through the process-wide cache, like load_shared
+    paths = tuple(paths)
+    return dataset_cache.get_or_create(("sample", paths, rows), lambda: load_sample(paths, rows)).copy(deep=False)
+
+
+def _is_number(t) -> bool:
+    return pa.types.is_integer(t) or pa.types.is_floating(t)
+
+
+def _unify(schema, table_schema):
+    # a schema holding the data of both: an all-null column takes the other type,
+    # numbers widen to float64 and any other mismatch (e.g. numbers then text) becomes text
+    fields = []
+    for field in schema:
+        a = field.type
+        b = table_schema.field(field.name).type if field.name in table_schema.names else pa.null()
+        if a == b or pa.types.is_null(b):
+            t = a
+        elif pa.types.is_null(a):
+            t = pa.float64() if pa.types.is_integer(b) else b
+        elif _is_number(a) and _is_number(b):
+            t = pa.float64()
+        else:
+            t = pa.string()
+        fields.append(pa.field(field.name, t))
+    return pa.schema(fields)
+
+
+def _widen(tmp, schema, generation):
+    # copy the batches written to tmp into a new file with a wider schema, one batch at a
+    # time, and return (new path, writer open on it). ipc files cannot be appended to.
+    wider = f"{tmp.rsplit('.part', 1)[0]}.{generation}.part"
+    writer = pa.ipc.new_file(wider, schema)
+    try:
+        with pa.memory_map(tmp) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                writer.write_table(pa.Table.from_batches([reader.get_batch(i)]).cast(schema))
+    except BaseException:
+        writer.close()
+        os.remove(wider)
+        raise
+    os.remove(tmp)
+    return wider, writer
+
+
+def save_dataset_chunks(chunks, key: str) -> str:
+    # write an iterable of frames into one arrow ipc file without holding them all in memory.
+    # the schema starts from the first chunk with integers widened to float64, since a
+    # later chunk with missing values would otherwise not fit. when a later chunk does not
+    # fit (a column that was all missing, or numbers followed by text) the schema is
+    # widened and the rows written so far are recast.
+    # key identifies the content (e.g. a hash of the source file); chunks are not read
+    # at all when it is already stored.
+    path = dataset_path(key)
+    if _reuse(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    writer = None
+    schema = None
+    widened = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if schema is None:
+                schema = pa.schema([
+                    pa.field(f.name, pa.float64()) if pa.types.is_integer(f.type) else f
+                    for f in table.schema
+                ])
+                writer = pa.ipc.new_file(tmp, schema)
+            wider = _unify(schema, table.schema)
+            if not wider.equals(schema):
+                writer.close()
+                writer = None
+                widened += 1
+                tmp, writer = _widen(tmp, wider, widened)
+                schema = wider
+            writer.write_table(table.cast(schema))
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if writer is None:
+        raise ValueError("No rows to save.")
+    writer.close()
+    os.replace(tmp, path)
+    return path
+
+
+def remove_dataset(path: str):
+    # delete a stored dataset file and its folder once empty
+    dataset_cache.discard(path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
@@ -0,0 +1,119 @@
+import os
+
+import pandas as pd
+
+from cache import BoundedCache
+from cube import CUBE_STATS, category_keys
+from dtypes import looks_like_dates, to_dates
+from jobs import check_cancelled
+
+# rollup levels from finest to coarsest: pandas period alias and label
+ROLLUP_LEVELS = [("D", "Daily"), ("W", "Weekly"), ("M", "Monthly")]
+# a chart uses the finest level with at most this many periods in its date range
+TS_MAX_POINTS = int(os.getenv("VIZION_TS_MAX_POINTS", "1000"))
+# lines drawn at most when a time series is split by a category (largest groups first)
+TS_MAX_SERIES = 10
+
+# date columns and rollups per dataset, shared by every session
+rollup_cache = BoundedCache(int(os.getenv("VIZION_ROLLUP_CACHE_MB", "64")) * 1024 * 1024, name="rollups")
+
+
+def date_columns(df: pd.DataFrame, content_hash: str):
+    # columns holding dates: datetime columns and text columns whose values parse as dates
+    def detect():
+        return [
+            c for c in df.columns
+            if pd.api.types.is_datetime64_any_dtype(df[c])
+            or (
+                (pd.api.types.is_object_dtype(df[c]) or pd.api.types.is_string_dtype(df[c]))
+                and looks_like_dates(df[c])
+            )
+        ]
+
+    return rollup_cache.get_or_create(("dates", content_hash), detect)
+
+
+def period_start(dates, freq):
+    # start of the period each date falls in
+    if freq == "D":
+        return dates.floor("D") if isinstance(dates, pd.Timestamp) else dates.dt.floor("D")
+    if isinstance(dates, pd.Timestamp):
+        return dates.to_period(freq).start_time
+    return dates.dt.to_period(freq).dt.start_time
+
+
+def parsed_dates(df: pd.DataFrame, content_hash: str, date_col) -> pd.Series:
+    # date_col as timezone-naive datetimes, parsed once per dataset
+    def parse():
+        dates = to_dates(df[date_col])
+        if getattr(dates.dt, "tz", None) is not None:
+            dates = dates.dt.tz_localize(None)
+        return dates
+
+    return rollup_cache.get_or_create(("parsed", content_hash, date_col), parse)
+
+
+def build_rollups(df: pd.DataFrame, dates: pd.Series, measure, split=None, job=None) -> dict:
+    # count / sum / min / max of a numeric column per day, week and month of dates,
+    # optionally also per value of the split column. returns
+    #   {"measure", "split", "start", "end", "tables": {level: frame}}
+    # where each frame is indexed by period start (and split value), sorted.
+    # one measure at a time: rolling up hundreds of columns per day would not fit in memory.
+    present = dates.notna()
+    values = df.loc[present, measure]
+    dates = dates[present]
+    split_key = category_keys(df, [split])[split][present] if split else None
+
+    tables = {}
+    for i, (freq, label) in enumerate(ROLLUP_LEVELS):
+        if job is not None:
+            job.report(i / len(ROLLUP_LEVELS), f"{label} rollup of {measure}...")
+        by = [period_start(dates, freq).rename(dates.name)]
+        if split_key is not None:
+            by.append(split_key)
+        tables[freq] = values.groupby(by, observed=True).agg(CUBE_STATS)
+        check_cancelled(job)
+    return {
+        "measure": measure,
+        "split": split,
+        "start": dates.min() if len(dates) else None,
+        "end": dates.max() if len(dates) else None,
+        "tables": tables,
+    }
+
+
+def get_rollups(df: pd.DataFrame, content_hash: str, date_col, measure, split=None, job=None) -> dict:
+    # build_rollups memoized per dataset, date column, measure and split
+    return rollup_cache.get_or_create(
+        ("rollups", content_hash, date_col, measure, split),
+        lambda: build_rollups(df, parsed_dates(df, content_hash, date_col), measure, split, job=job)
+    )
+
+
+def rollup_level(start, end, max_points=TS_MAX_POINTS):
+    # finest level with at most max_points periods between start and end
+    days = (end - start).days + 1
+    for freq, label in ROLLUP_LEVELS:
+        periods = {"D": days, "W": days / 7, "M": days / 30.4}[freq]
+        if periods <= max_points:
+            return freq, label
+    return ROLLUP_LEVELS[-1]
+
+
+def rollup_series(rollups: dict, start=None, end=None, max_points=TS_MAX_POINTS):
+    # average of the measure per period between start and end, read from the level that
+    # fits the range. a series, or a frame with one column per split value when split.
+    # returns (values, level label), values None when there are no dates.
+    if rollups["start"] is None:
+        return None, None
+    start = pd.Timestamp(start) if start is not None else rollups["start"]
+    end = pd.Timestamp(end) if end is not None else rollups["end"]
+    freq, label = rollup_level(start, end, max_points)
+    stats = rollups["tables"][freq]
+    # the index is sorted, so this is a binary search rather than a scan
+    stats = stats.loc[period_start(start, freq):end]
+    mean = stats["sum"] / stats["count"].where(stats["count"] > 0)
+    if rollups["split"] is None:
+        return mean.rename(rollups["measure"]), label
+    counts = stats["count"].groupby(level=1, observed=True).sum().nlargest(TS_MAX_SERIES)
+    return mean.unstack(level=1)[counts.index], label
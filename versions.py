@@ -0,0 +1,265 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import uuid
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import perf
+from cube import build_cube, cube_cache, merge_cube
+from dtypes import to_dates
+from ingest import CHUNK_ROWS, StreamingProfile
+from models import DatasetVersion
+from profiler import frame_hash, profile_cache, store_profile
+from storage import DATA_DIR, load_parts, save_dataset
+
+# statistics kept next to every version so the next append only has to read the new rows:
+# a zip of state.json (scalar statistics, column types, cube layout), the row sample and
+# one arrow file per cube table. no pickles, so a state file cannot run code when loaded.
+STATE_FILE = "state.zip"
+
+
+def version_hash(previous: str, chunk_hash: str) -> str:
+    # content hash of a dataset after appending a chunk to data with hash previous
+    return hashlib.sha256(f"{previous}+{chunk_hash}".encode("utf-8")).hexdigest()
+
+
+def dataset_files(dataset):
+    # the stored files holding the rows of a dataset, in order
+    return [dataset.storage_path] + [v.storage_path for v in dataset.versions]
+
+
+def stored_files(dataset):
+    # every file a dataset refers to, for release_storage
+    return dataset_files(dataset) + [v.state_path for v in dataset.versions if v.state_path]
+
+
+def state_path(content_hash: str) -> str:
+    return os.path.join(DATA_DIR, content_hash, STATE_FILE)
+
+
+def build_state(df: pd.DataFrame, job=None) -> dict:
+    # mergeable statistics of a frame: the streaming profile (counts, moments, missing
+    # counts, top values, row sample) and the aggregate cube, plus the column types
+    profile = StreamingProfile()
+    for start in range(0, len(df), CHUNK_ROWS):
+        profile.update(df.iloc[start:start + CHUNK_ROWS])
+    return {"profile": profile, "cube": build_cube(df, job=job), "dtypes": df.dtypes}
+
+
+def _arrow_bytes(frame: pd.DataFrame) -> bytes:
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # object columns mixing types are stored as text, like save_dataset_chunks does
+        frame = frame.apply(lambda s: s.astype(str).where(s.notna(), None) if s.dtype == object else s)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    buf = io.BytesIO()
+    feather.write_feather(table, buf, compression="uncompressed")
+    return buf.getvalue()
+
+
+def _read_arrow(archive, name) -> pd.DataFrame:
+    return feather.read_table(pa.BufferReader(archive.read(name))).to_pandas()
+
+
+def _json_value(v):
+    # numpy scalars in the statistics
+    if isinstance(v, np.generic):
+        return v.item()
+    raise TypeError(f"{type(v).__name__} is not serializable")
+
+
+def _profile_meta(profile: StreamingProfile) -> dict:
+    stats = {}
+    for col in profile.columns:
+        col_stats = dict(profile.stats[col])
+        values = col_stats["values"]
+        col_stats["values"] = {"index": list(values.index), "counts": list(values)}
+        col_stats["hll"] = base64.b64encode(col_stats["hll"].tobytes()).decode("ascii")
+        stats[col] = col_stats
+    return {
+        "rows": profile.rows,
+        "columns": profile.columns,
+        "sample_rows": profile.sample_rows,
+        "rng": profile.rng.bit_generator.state,
+        "stats": stats,
+    }
+
+
+def _load_profile(meta: dict, archive) -> StreamingProfile:
+    profile = StreamingProfile(sample_rows=meta["sample_rows"])
+    profile.rng.bit_generator.state = meta["rng"]
+    profile.rows = meta["rows"]
+    profile.columns = meta["columns"]
+    for col, col_stats in meta["stats"].items():
+        values = col_stats["values"]
+        col_stats["values"] = pd.Series(values["counts"], index=values["index"], dtype=None if values["counts"] else "int64")
+        col_stats["hll"] = np.frombuffer(base64.b64decode(col_stats["hll"]), dtype=np.uint8).copy()
+        profile.stats[col] = col_stats
+    if "sample.arrow" in archive.namelist():
+        profile.sample = _read_arrow(archive, "sample.arrow")
+        profile.sample_keys = _read_arrow(archive, "sample_keys.arrow")["key"].to_numpy()
+    return profile
+
+
+def _load_cube(meta: dict, archive) -> dict:
+    # cube tables are stored flat: index levels i0, i1 then value columns c0, c1, ...
+    tables = {}
+    for i, spec in enumerate(meta["tables"]):
+        dims = tuple(spec["dims"])
+        table = _read_arrow(archive, f"cube/{i}.arrow")
+        table = table.set_index([f"i{k}" for k in range(len(dims))])
+        table.index.names = list(dims)
+        columns = [tuple(c) if isinstance(c, list) else c for c in spec["columns"]]
+        table.columns = pd.MultiIndex.from_tuples(columns) if isinstance(columns[0], tuple) else columns
+        tables[dims] = table
+    return {"dimensions": meta["dimensions"], "measures": meta["measures"], "tables": tables}
+
+
+def load_state(path, cube_only=False):
+    # saved statistics of a version, or None when they are missing. state files of the
+    # older pickle format are treated as missing and rebuilt from the data.
+    if not path or not path.endswith(".zip") or not os.path.exists(path):
+        return None
+    with zipfile.ZipFile(path) as archive:
+        meta = json.loads(archive.read("state.json"))
+        cube = _load_cube(meta["cube"], archive)
+        if cube_only:
+            return {"cube": cube}
+        return {
+            "profile": _load_profile(meta["profile"], archive),
+            "cube": cube,
+            "dtypes": pd.Series({c: pd.api.types.pandas_dtype(d) for c, d in meta["dtypes"].items()}, dtype=object),
+        }
+
+
+def save_state(state: dict, content_hash: str) -> str:
+    path = state_path(content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    profile, cube = state["profile"], state["cube"]
+    tables = []
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as archive:
+        for i, (dims, table) in enumerate(cube["tables"].items()):
+            tables.append({"dims": list(dims), "columns": list(table.columns)})
+            flat = table.copy()
+            flat.columns = [f"c{k}" for k in range(flat.shape[1])]
+            flat.index.names = [f"i{k}" for k in range(len(dims))]
+            archive.writestr(f"cube/{i}.arrow", _arrow_bytes(flat.reset_index()))
+        if profile.sample is not None:
+            archive.writestr("sample.arrow", _arrow_bytes(profile.sample))
+            archive.writestr("sample_keys.arrow", _arrow_bytes(pd.DataFrame({"key": profile.sample_keys})))
+        meta = {
+            "profile": _profile_meta(profile),
+            "cube": {"dimensions": cube["dimensions"], "measures": cube["measures"], "tables": tables},
+            "dtypes": {c: str(d) for c, d in state["dtypes"].items()},
+        }
+        archive.writestr("state.json", json.dumps(meta, default=_json_value))
+    os.replace(tmp, path)
+    return path
+
+
+def conform(rows: pd.DataFrame, dtypes: pd.Series) -> pd.DataFrame:
+    # the new rows in the column order of the dataset, with numbers and dates parsed
+    # like the stored ones so the parts concatenate without turning into text
+    missing = [c for c in dtypes.index if c not in rows.columns]
+    extra = [c for c in rows.columns if c not in dtypes.index]
+    if missing or extra:
+        raise ValueError(
+            "Appended rows must have the same columns as the dataset "
+            f"(missing: {', '.join(map(str, missing)) or 'none'}; extra: {', '.join(map(str, extra)) or 'none'})."
+        )
+    columns = {}
+    for col, dtype in dtypes.items():
+        s = rows[col]
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            s = to_dates(s)
+            tz = getattr(dtype, "tz", None)
+            if tz is not None and getattr(s.dt, "tz", None) is None:
+                s = s.dt.tz_localize(tz)
+            elif tz is None and getattr(s.dt, "tz", None) is not None:
+                s = s.dt.tz_localize(None)
+        elif pd.api.types.is_bool_dtype(dtype):
+            if not pd.api.types.is_bool_dtype(s):
+                s = s.astype(str).str.strip().str.lower().map({"true": True, "false": False})
+        elif pd.api.types.is_numeric_dtype(dtype):
+            s = pd.to_numeric(s, errors="coerce")
+        columns[col] = s
+    return pd.DataFrame(columns, index=rows.index).reset_index(drop=True)
+
+
+def prepare_version(paths, latest_state, previous_hash, rows: pd.DataFrame, job=None) -> dict:
+    # store rows as the next version of the dataset held in paths and update its
+    # statistics from them alone. the statistics of the previous version are read from
+    # its state file latest_state; the first append (or one whose state file is gone)
+    # builds them once from the full data. runs as a job, so it only takes plain values;
+    # append_version records the result.
+    state = load_state(latest_state)
+    if state is None:
+        with perf.span("version base state"):
+            df = load_parts(paths)
+            state = build_state(df, job=job)
+            if previous_hash is None:
+                # saved before datasets were stored by content
+                previous_hash = frame_hash(df)
+            del df
+
+    rows = conform(rows, state["dtypes"])
+    if rows.empty:
+        raise ValueError("No rows to append.")
+
+    with perf.span("version delta", rows=len(rows)):
+        chunk_hash = frame_hash(rows)
+        chunk_path = save_dataset(rows, chunk_hash)
+        state["profile"].update(rows)
+        state["cube"] = merge_cube(state["cube"], rows, job=job)
+
+    content_hash = version_hash(previous_hash, chunk_hash)
+    profile = state["profile"].profile()
+    store_profile(content_hash, profile)
+    profile_cache.put(content_hash, profile)
+    cube_cache.put(content_hash, state["cube"])
+    return {
+        "storage_path": chunk_path,
+        "state_path": save_state(state, content_hash),
+        "content_hash": content_hash,
+        "row_count": len(rows),
+    }
+
+
+def append_version(session, dataset, prepared: dict):
+    # add the version stored by prepare_version to dataset. adds the DatasetVersion to
+    # the session, the caller commits.
+    latest = dataset.versions[-1] if dataset.versions else None
+    version = DatasetVersion(
+        id=str(uuid.uuid4()),
+        dataset_id=dataset.id,
+        version=latest.version + 1 if latest else 1,
+        created_at=datetime.utcnow(),
+        **prepared
+    )
+    dataset.versions.append(version)
+    dataset.content_hash = prepared["content_hash"]
+    dataset.row_count = (dataset.row_count or 0) + prepared["row_count"]
+    session.add(version)
+    return version
+
+
+def prime_caches(dataset):
+    # put the cube of the latest version in the cube cache from its state file, so
+    # opening a dataset after a restart does not aggregate all of its rows again.
+    # only the cube tables are read, not the row sample.
+    if not dataset.versions or cube_cache.peek(dataset.content_hash) is not None:
+        return
+    state = load_state(dataset.versions[-1].state_path, cube_only=True)
+    if state is not None:
+        cube_cache.put(dataset.content_hash, state["cube"])